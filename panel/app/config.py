@@ -25,6 +25,7 @@ class Settings(BaseSettings):
     node_key_path: str = "./certs/ca.key"
     node_server_cert_path: str = "./certs/ca-server.crt"
     node_server_key_path: str = "./certs/ca-server.key"
+    node_failure_cache_ttl: float = 10.0
     
     secret_key: str = "changeme-secret-key-change-in-production"
     
@@ -1,5 +1,7 @@
 """Database setup and session management"""
 import os
+import orjson
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from app.config import settings
@@ -11,10 +13,42 @@ if settings.db_type == "sqlite":
 else:
     raise ValueError(f"Unsupported DB type: {settings.db_type}")
 
-engine = create_async_engine(db_url, echo=False)
+
+def _json_serializer(value) -> str:
+    """Serialize JSON columns (mesh configs, tunnel specs) with orjson"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+engine = create_async_engine(
+    db_url,
+    echo=False,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads
+)
 AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+def _add_missing_columns(conn):
+    """Add nullable columns introduced after a table was created (create_all never alters tables)"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def _create_missing_indexes(conn):
+    """Create indexes added to existing tables (create_all skips tables that already exist)"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def init_db():
     """Initialize database tables"""
     if settings.db_type == "sqlite":
@@ -22,6 +56,8 @@ async def init_db():
     
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
 
 
 async def get_db():
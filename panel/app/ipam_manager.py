@@ -1,17 +1,29 @@
 """IP Address Management (IPAM) for Overlay IPs"""
 import logging
 import ipaddress
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm.attributes import flag_modified
 from app.models import OverlayPool, OverlayAssignment, Node
 
 logger = logging.getLogger(__name__)
 
+# The pool CIDR is read on every allocation but only changes through the overlay pool endpoints
+POOL_CIDR_CACHE_TTL = 30.0
+
 
 class IPAMManager:
     """Manages overlay IP address allocation and assignment"""
     
+    def __init__(self):
+        self._pool_cidr_cache: Optional[Tuple[float, Optional[str]]] = None
+    
+    def invalidate_pool_cache(self):
+        """Forget the cached pool CIDR after the pool is created or deleted"""
+        self._pool_cidr_cache = None
+    
     async def get_or_create_pool(self, db: AsyncSession, cidr: str, description: Optional[str] = None) -> OverlayPool:
         """Get existing pool or create new one"""
         result = await db.execute(
@@ -24,6 +36,7 @@ class IPAMManager:
             db.add(pool)
             await db.commit()
             await db.refresh(pool)
+            self.invalidate_pool_cache()
             logger.info(f"Created overlay pool: {cidr}")
         
         return pool
@@ -33,6 +46,17 @@ class IPAMManager:
         result = await db.execute(select(OverlayPool))
         return result.scalar_one_or_none()
     
+    async def get_pool_cidr(self, db: AsyncSession) -> Optional[str]:
+        """Get the overlay pool CIDR, cached for POOL_CIDR_CACHE_TTL seconds"""
+        now = time.monotonic()
+        if self._pool_cidr_cache and now - self._pool_cidr_cache[0] < POOL_CIDR_CACHE_TTL:
+            return self._pool_cidr_cache[1]
+        
+        result = await db.execute(select(OverlayPool.cidr))
+        cidr = result.scalar_one_or_none()
+        self._pool_cidr_cache = (now, cidr)
+        return cidr
+    
     async def allocate_ip(
         self,
         db: AsyncSession,
@@ -52,13 +76,13 @@ class IPAMManager:
         Returns:
             Allocated IP address or None if pool exhausted
         """
-        pool = await self.get_pool(db)
-        if not pool:
+        pool_cidr = await self.get_pool_cidr(db)
+        if not pool_cidr:
             logger.error("No overlay pool configured")
             return None
         
         try:
-            network = ipaddress.ip_network(pool.cidr, strict=False)
+            network = ipaddress.ip_network(pool_cidr, strict=False)
         except ValueError as e:
             logger.error(f"Invalid CIDR in pool: {e}")
             return None
@@ -76,7 +100,7 @@ class IPAMManager:
             try:
                 ip = ipaddress.ip_address(preferred_ip)
                 if ip not in network:
-                    logger.warning(f"Preferred IP {preferred_ip} not in pool {pool.cidr}")
+                    logger.warning(f"Preferred IP {preferred_ip} not in pool {pool_cidr}")
                     preferred_ip = None
                 else:
                     existing_ip_check = await db.execute(
@@ -95,7 +119,7 @@ class IPAMManager:
             allocated_ip = await self._find_free_ip(db, network)
         
         if not allocated_ip:
-            logger.error(f"No free IPs available in pool {pool.cidr}")
+            logger.error(f"No free IPs available in pool {pool_cidr}")
             return None
         
         assignment = OverlayAssignment(
@@ -105,12 +129,12 @@ class IPAMManager:
         )
         db.add(assignment)
         
-        node_result = await db.execute(select(Node).where(Node.id == node_id))
-        node = node_result.scalar_one_or_none()
+        node = await db.get(Node, node_id)
         if node:
             if not node.node_metadata:
                 node.node_metadata = {}
             node.node_metadata["overlay_ip"] = allocated_ip
+            flag_modified(node, "node_metadata")
             await db.commit()
             await db.refresh(assignment)
             logger.info(f"Allocated overlay IP {allocated_ip} to node {node_id} and updated node_metadata")
@@ -121,6 +145,75 @@ class IPAMManager:
         
         return allocated_ip
     
+    async def allocate_ips(
+        self,
+        db: AsyncSession,
+        node_ids: List[str],
+        interface_name: str = "wg0"
+    ) -> Dict[str, str]:
+        """
+        Allocate overlay IPs for several nodes in one transaction
+        
+        Nodes that already have an assignment keep their existing IP.
+        
+        Args:
+            db: Database session
+            node_ids: Node IDs to assign IPs to
+            interface_name: WireGuard interface name
+        
+        Returns:
+            Dict mapping node_id to overlay IP; nodes left out when the pool is exhausted
+        """
+        if not node_ids:
+            return {}
+        
+        pool_cidr = await self.get_pool_cidr(db)
+        if not pool_cidr:
+            logger.error("No overlay pool configured")
+            return {}
+        
+        try:
+            network = ipaddress.ip_network(pool_cidr, strict=False)
+        except ValueError as e:
+            logger.error(f"Invalid CIDR in pool: {e}")
+            return {}
+        
+        existing_result = await db.execute(select(OverlayAssignment))
+        existing_assignments = existing_result.scalars().all()
+        allocated = {a.node_id: a.overlay_ip for a in existing_assignments if a.node_id in node_ids}
+        assigned_ips = {ipaddress.ip_address(a.overlay_ip) for a in existing_assignments}
+        
+        missing = [node_id for node_id in node_ids if node_id not in allocated]
+        if not missing:
+            return allocated
+        
+        free_hosts = (host for host in network.hosts() if host not in assigned_ips)
+        new_ips = {}
+        for node_id in missing:
+            host = next(free_hosts, None)
+            if host is None:
+                logger.error(f"No free IPs available in pool {pool_cidr}")
+                break
+            new_ips[node_id] = str(host)
+        
+        if not new_ips:
+            return allocated
+        
+        db.add_all([
+            OverlayAssignment(node_id=node_id, overlay_ip=ip, interface_name=interface_name)
+            for node_id, ip in new_ips.items()
+        ])
+        
+        node_result = await db.execute(select(Node).where(Node.id.in_(list(new_ips.keys()))))
+        for node in node_result.scalars().all():
+            node.node_metadata = {**(node.node_metadata or {}), "overlay_ip": new_ips[node.id]}
+        
+        await db.commit()
+        logger.info(f"Allocated overlay IPs {new_ips}")
+        
+        allocated.update(new_ips)
+        return allocated
+    
     async def _find_free_ip(self, db: AsyncSession, network: ipaddress.IPv4Network) -> Optional[str]:
         """Find first available IP in the network"""
         existing_result = await db.execute(select(OverlayAssignment))
@@ -157,6 +250,15 @@ class IPAMManager:
         assignment = result.scalar_one_or_none()
         return assignment.overlay_ip if assignment else None
     
+    async def get_node_ips(self, db: AsyncSession, node_ids: List[str]) -> Dict[str, str]:
+        """Get overlay IPs for several nodes in one query, keyed by node ID"""
+        if not node_ids:
+            return {}
+        result = await db.execute(
+            select(OverlayAssignment).where(OverlayAssignment.node_id.in_(node_ids))
+        )
+        return {assignment.node_id: assignment.overlay_ip for assignment in result.scalars().all()}
+    
     async def update_node_ip(
         self,
         db: AsyncSession,
@@ -165,15 +267,15 @@ class IPAMManager:
         interface_name: str = "wg0"
     ) -> bool:
         """Update overlay IP for a node (manual override)"""
-        pool = await self.get_pool(db)
-        if not pool:
+        pool_cidr = await self.get_pool_cidr(db)
+        if not pool_cidr:
             return False
         
         try:
-            network = ipaddress.ip_network(pool.cidr, strict=False)
+            network = ipaddress.ip_network(pool_cidr, strict=False)
             ip = ipaddress.ip_address(new_ip)
             if ip not in network:
-                logger.error(f"IP {new_ip} not in pool {pool.cidr}")
+                logger.error(f"IP {new_ip} not in pool {pool_cidr}")
                 return False
         except ValueError as e:
             logger.error(f"Invalid IP address: {e}")
@@ -20,6 +20,9 @@ class Node(Base):
     registered_at = Column(DateTime, default=datetime.utcnow)
     last_seen = Column(DateTime, default=datetime.utcnow)
     node_metadata = Column("metadata", JSON, default=dict)
+    # Mirrors of node_metadata["role"] / ["ip_address"] so they can be filtered in SQL
+    role = Column(String, nullable=True, index=True)
+    ip_address = Column(String, nullable=True)
     
 
 class Tunnel(Base):
@@ -30,6 +33,7 @@ class Tunnel(Base):
     core = Column(String, nullable=False)
     type = Column(String, nullable=False)
     node_id = Column(String, nullable=False)
+    mesh_id = Column(String, nullable=True, index=True)
     spec = Column(JSON, nullable=False)
     quota_mb = Column(Float, default=0)
     used_mb = Column(Float, default=0)
@@ -1,27 +1,68 @@
 """Client for panel to communicate with nodes"""
 import httpx
+import orjson
 import ssl
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from pathlib import Path
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from app.database import AsyncSessionLocal
 from app.models import Node
 
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Substrings of an agent error message that mean the node is likely coming back
+RECONNECT_MARKERS = ("timeout", "connection")
+
+
+def classify_connection(
+    response: Optional[Dict[str, Any]],
+    exc: Optional[Exception] = None
+) -> Tuple[str, Optional[str]]:
+    """Map a node status probe result to (connection status, error message)"""
+    if exc is not None:
+        if isinstance(exc, httpx.ConnectError):
+            return "connecting", "Connecting to node..."
+        if isinstance(exc, httpx.TimeoutException):
+            return "reconnecting", "Connection timeout"
+        return "failed", str(exc)
+    
+    if response and response.get("status") == "ok":
+        return "connected", None
+    
+    error_msg = response.get("message", "Node disconnected") if response else "Node not responding"
+    lowered = error_msg.lower()
+    if any(marker in lowered for marker in RECONNECT_MARKERS):
+        return "reconnecting", error_msg
+    return "failed", error_msg
+
+
 class NodeClient:
     """Client to send requests to nodes via HTTP/HTTPS"""
     
     def __init__(self):
         self.timeout = httpx.Timeout(30.0)
+        self.limits = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60)
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled HTTP client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, verify=False)
+        return self._client
+    
+    async def close(self):
+        """Close pooled connections to nodes"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def send_to_node(self, node_id: str, endpoint: str, data: Dict[str, Any] = None, method: str = "POST") -> Dict[str, Any]:
         """
         Send request to node via HTTPS
         """
         async with AsyncSessionLocal() as session:
-            result = await session.execute(select(Node).where(Node.id == node_id))
-            node = result.scalar_one_or_none()
+            node = await session.get(Node, node_id)
             
             if not node:
                 return {"status": "error", "message": f"Node {node_id} not found"}
@@ -34,13 +75,14 @@ class NodeClient:
             url = f"{node_address.rstrip('/')}{endpoint}"
             
             try:
-                async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-                    if method.upper() == "GET":
-                        response = await client.get(url, params=data or {})
-                    else:
-                        response = await client.post(url, json=data or {})
-                    response.raise_for_status()
-                    return response.json()
+                client = self._get_client()
+                if method.upper() == "GET":
+                    response = await client.get(url, params=data or {})
+                else:
+                    # orjson encodes the (often large) tunnel/mesh specs faster than httpx's stdlib json
+                    response = await client.post(url, content=orjson.dumps(data or {}), headers=_JSON_HEADERS)
+                response.raise_for_status()
+                return response.json()
             except httpx.RequestError as e:
                 return {"status": "error", "message": f"Network error: {str(e)}"}
             except httpx.HTTPStatusError as e:
@@ -55,8 +97,7 @@ class NodeClient:
     async def get_tunnel_status(self, node_id: str, tunnel_id: str = "") -> Dict[str, Any]:
         """Get tunnel status from node"""
         async with AsyncSessionLocal() as session:
-            result = await session.execute(select(Node).where(Node.id == node_id))
-            node = result.scalar_one_or_none()
+            node = await session.get(Node, node_id)
             
             if not node:
                 return {"status": "error", "message": f"Node {node_id} not found"}
@@ -69,10 +110,9 @@ class NodeClient:
             url = f"{node_address.rstrip('/')}/api/agent/status"
             
             try:
-                async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-                    response = await client.get(url)
-                    response.raise_for_status()
-                    return response.json()
+                response = await self._get_client().get(url)
+                response.raise_for_status()
+                return response.json()
             except httpx.RequestError as e:
                 return {"status": "error", "message": f"Network error: {str(e)}"}
             except httpx.HTTPStatusError as e:
@@ -87,3 +127,6 @@ class NodeClient:
     async def apply_tunnel(self, node_id: str, tunnel_data: Dict[str, Any]) -> Dict[str, Any]:
         """Apply tunnel to node"""
         return await self.send_to_node(node_id, "/api/agent/tunnels/apply", tunnel_data)
+
+
+node_client = NodeClient()
@@ -1,22 +1,36 @@
 """Core Health and Reset API endpoints"""
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List, Dict, Any
+from sqlalchemy import select, func
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 import logging
 import asyncio
+import time
 import httpx
 
+from app.config import settings
 from app.database import get_db
-from app.models import Tunnel, Node, CoreResetConfig
-from app.node_client import NodeClient
+from app.models import Tunnel, Node, CoreResetConfig, generate_uuid
+from app.node_client import NodeClient, classify_connection, node_client
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 CORES = ["frp"]
+MAX_PARALLEL_RESETS = 8
+TUNNEL_FETCH_BATCH = 200
+RESET_CONFIG_CACHE_TTL = 5.0
+
+# core -> (monotonic timestamp, response); dashboards poll /reset-config often
+_reset_config_cache: Dict[str, Tuple[float, "ResetConfigResponse"]] = {}
+
+# node_id -> (monotonic timestamp, (status, error_message)) for failed probes,
+# so a down node doesn't cost a full connect timeout on every /health poll
+_node_failure_cache: Dict[str, Tuple[float, Tuple[str, Optional[str]]]] = {}
 
 
 class CoreHealthResponse(BaseModel):
@@ -38,6 +52,28 @@ class ResetConfigUpdate(BaseModel):
     interval_minutes: int | None = None
 
 
+async def _probe_node(client: NodeClient, core: str, node_id: str, label: str) -> Tuple[str, Optional[str]]:
+    """Probe a node's agent status, reusing a recent failure instead of re-probing"""
+    now = time.monotonic()
+    cached = _node_failure_cache.get(node_id)
+    if cached and now - cached[0] < settings.node_failure_cache_ttl:
+        return cached[1]
+    
+    try:
+        response = await client.get_tunnel_status(node_id, "")
+        result = classify_connection(response)
+    except Exception as e:
+        if not isinstance(e, (httpx.ConnectError, httpx.TimeoutException)):
+            logger.error(f"Error checking {core} {label} {node_id} health: {e}")
+        result = classify_connection(None, e)
+    
+    if result[0] == "connected":
+        _node_failure_cache.pop(node_id, None)
+    else:
+        _node_failure_cache[node_id] = (time.monotonic(), result)
+    return result
+
+
 @router.get("/health", response_model=List[CoreHealthResponse])
 async def get_core_health(request: Request, db: AsyncSession = Depends(get_db)):
     """Get health status for all cores"""
@@ -46,97 +82,56 @@ async def get_core_health(request: Request, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Node))
     all_nodes = result.scalars().all()
     
-    iran_nodes_all = {n.id: n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "iran"}
-    foreign_nodes_all = {n.id: n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "foreign"}
+    iran_nodes_all = {}
+    foreign_nodes_all = {}
+    for n in all_nodes:
+        if n.role == "iran":
+            iran_nodes_all[n.id] = n
+        elif n.role == "foreign":
+            foreign_nodes_all[n.id] = n
+    
+    # Only whether a core has active tunnels matters here, so count them per core in SQL
+    count_result = await db.execute(
+        select(Tunnel.core, func.count())
+        .where(Tunnel.core.in_(CORES), Tunnel.status == "active")
+        .group_by(Tunnel.core)
+    )
+    active_counts = dict(count_result.all())
     
     for core in CORES:
-        result = await db.execute(select(Tunnel).where(Tunnel.core == core, Tunnel.status == "active"))
-        active_tunnels = result.scalars().all()
-        
-        node_ids = set(t.node_id for t in active_tunnels if t.node_id)
-        
-        for tunnel in active_tunnels:
-            if tunnel.spec and tunnel.spec.get("foreign_node_id"):
-                node_ids.add(tunnel.spec.get("foreign_node_id"))
+        # A tunnel needs both an iran and a foreign side, so there is nothing to probe
+        if not active_counts.get(core) or not iran_nodes_all or not foreign_nodes_all:
+            health_data.append(CoreHealthResponse(
+                core=core,
+                nodes_status={},
+                servers_status={}
+            ))
+            continue
         
         iran_nodes = {}
         foreign_nodes = {}
         
-        client = NodeClient()
+        client = node_client
         
         for node_id, node in iran_nodes_all.items():
-            connection_status = {
-                "status": "failed",
-                "error_message": None
-            }
-            
-            try:
-                response = await client.get_tunnel_status(node_id, "")
-                if response and response.get("status") == "ok":
-                    connection_status["status"] = "connected"
-                else:
-                    error_msg = response.get("message", "Node disconnected") if response else "Node not responding"
-                    if "timeout" in error_msg.lower() or "connection" in error_msg.lower():
-                        connection_status["status"] = "reconnecting"
-                    else:
-                        connection_status["status"] = "failed"
-                    connection_status["error_message"] = error_msg
-            except httpx.ConnectError:
-                connection_status["status"] = "connecting"
-                connection_status["error_message"] = "Connecting to node..."
-            except httpx.TimeoutException:
-                connection_status["status"] = "reconnecting"
-                connection_status["error_message"] = "Connection timeout"
-            except Exception as e:
-                logger.error(f"Error checking {core} node {node_id} health: {e}")
-                connection_status["status"] = "failed"
-                connection_status["error_message"] = str(e)
-            
-            node_info = {
+            status, error_message = await _probe_node(client, core, node_id, "node")
+            iran_nodes[node_id] = {
                 "id": node_id,
                 "name": node.name,
                 "role": "iran",
-                **connection_status
+                "status": status,
+                "error_message": error_message
             }
-            
-            iran_nodes[node_id] = node_info
         
         for node_id, node in foreign_nodes_all.items():
-            connection_status = {
-                "status": "failed",
-                "error_message": None
-            }
-            
-            try:
-                response = await client.get_tunnel_status(node_id, "")
-                if response and response.get("status") == "ok":
-                    connection_status["status"] = "connected"
-                else:
-                    error_msg = response.get("message", "Node disconnected") if response else "Node not responding"
-                    if "timeout" in error_msg.lower() or "connection" in error_msg.lower():
-                        connection_status["status"] = "reconnecting"
-                    else:
-                        connection_status["status"] = "failed"
-                    connection_status["error_message"] = error_msg
-            except httpx.ConnectError:
-                connection_status["status"] = "connecting"
-                connection_status["error_message"] = "Connecting to node..."
-            except httpx.TimeoutException:
-                connection_status["status"] = "reconnecting"
-                connection_status["error_message"] = "Connection timeout"
-            except Exception as e:
-                logger.error(f"Error checking {core} server {node_id} health: {e}")
-                connection_status["status"] = "failed"
-                connection_status["error_message"] = str(e)
-            
-            node_info = {
+            status, error_message = await _probe_node(client, core, node_id, "server")
+            foreign_nodes[node_id] = {
                 "id": node_id,
                 "name": node.name,
                 "role": "foreign",
-                **connection_status
+                "status": status,
+                "error_message": error_message
             }
-            
-            foreign_nodes[node_id] = node_info
         
         health_data.append(CoreHealthResponse(
             core=core,
@@ -150,31 +145,80 @@ async def get_core_health(request: Request, db: AsyncSession = Depends(get_db)):
 @router.get("/reset-config", response_model=List[ResetConfigResponse])
 async def get_reset_configs(db: AsyncSession = Depends(get_db)):
     """Get reset timer configuration for all cores"""
-    configs = []
+    now = time.monotonic()
+    cached_configs = {}
     
     for core in CORES:
-        result = await db.execute(select(CoreResetConfig).where(CoreResetConfig.core == core))
-        config = result.scalar_one_or_none()
-        
-        if not config:
-            config = CoreResetConfig(
-                core=core,
-                enabled=False,
-                interval_minutes=10
-            )
-            db.add(config)
-            await db.commit()
-            await db.refresh(config)
+        cached = _reset_config_cache.get(core)
+        if cached and now - cached[0] < RESET_CONFIG_CACHE_TTL:
+            cached_configs[core] = cached[1]
+    
+    missing = [core for core in CORES if core not in cached_configs]
+    if missing:
+        # Default rows are seeded on startup, so this path never writes
+        result = await db.execute(select(CoreResetConfig).where(CoreResetConfig.core.in_(missing)))
+        rows = {config.core: config for config in result.scalars().all()}
         
-        configs.append(ResetConfigResponse(
-            core=config.core,
-            enabled=config.enabled,
-            interval_minutes=config.interval_minutes,
-            last_reset=config.last_reset,
-            next_reset=config.next_reset
-        ))
+        for core in missing:
+            config = rows.get(core)
+            if config:
+                response = ResetConfigResponse(
+                    core=config.core,
+                    enabled=config.enabled,
+                    interval_minutes=config.interval_minutes,
+                    last_reset=config.last_reset,
+                    next_reset=config.next_reset
+                )
+            else:
+                response = ResetConfigResponse(
+                    core=core,
+                    enabled=False,
+                    interval_minutes=10,
+                    last_reset=None,
+                    next_reset=None
+                )
+            # Don't overwrite an entry a PUT or manual reset stored after this read began
+            stored = _reset_config_cache.get(core)
+            if not stored or stored[0] <= now:
+                _reset_config_cache[core] = (now, response)
+            cached_configs[core] = response
+    
+    return [cached_configs[core] for core in CORES]
+
+
+async def seed_reset_configs(db: AsyncSession):
+    """Create default reset config rows for cores that don't have one yet"""
+    result = await db.execute(select(CoreResetConfig.core))
+    existing = set(result.scalars().all())
+    
+    missing = [core for core in CORES if core not in existing]
+    for core in missing:
+        await db.execute(
+            sqlite_insert(CoreResetConfig)
+            .values(id=generate_uuid(), core=core, enabled=False, interval_minutes=10)
+            .on_conflict_do_nothing(index_elements=["core"])
+        )
     
-    return configs
+    if missing:
+        await db.commit()
+
+
+def invalidate_reset_config_cache(core: str):
+    """Drop the cached reset config for a core after it has been modified"""
+    _reset_config_cache.pop(core, None)
+
+
+def _cache_reset_config(config: CoreResetConfig) -> ResetConfigResponse:
+    """Store a just-committed reset config in the cache and return its response"""
+    response = ResetConfigResponse(
+        core=config.core,
+        enabled=config.enabled,
+        interval_minutes=config.interval_minutes,
+        last_reset=config.last_reset,
+        next_reset=config.next_reset
+    )
+    _reset_config_cache[config.core] = (time.monotonic(), response)
+    return response
 
 
 @router.put("/reset-config/{core}", response_model=ResetConfigResponse)
@@ -187,6 +231,9 @@ async def update_reset_config(
     if core not in CORES:
         raise HTTPException(status_code=400, detail=f"Invalid core: {core}")
     
+    # Columns are naive UTC, so keep a single naive UTC timestamp for the request
+    now = datetime.utcnow()
+    
     result = await db.execute(select(CoreResetConfig).where(CoreResetConfig.core == core))
     config = result.scalar_one_or_none()
     
@@ -203,7 +250,6 @@ async def update_reset_config(
         config.interval_minutes = config_update.interval_minutes
     
         if config.enabled and config.interval_minutes:
-            now = datetime.utcnow()
             if config.last_reset:
                 calculated_next = config.last_reset + timedelta(minutes=config.interval_minutes)
                 if calculated_next > now:
@@ -215,17 +261,12 @@ async def update_reset_config(
     else:
         config.next_reset = None
     
-    config.updated_at = datetime.utcnow()
+    config.updated_at = now
     await db.commit()
     await db.refresh(config)
     
-    return ResetConfigResponse(
-        core=config.core,
-        enabled=config.enabled,
-        interval_minutes=config.interval_minutes,
-        last_reset=config.last_reset,
-        next_reset=config.next_reset
-    )
+    # Cache only after the commit so concurrent GETs can't re-cache the old row
+    return _cache_reset_config(config)
 
 
 @router.post("/reset/{core}")
@@ -249,6 +290,7 @@ async def manual_reset_core(core: str, request: Request, db: AsyncSession = Depe
             config.next_reset = reset_time + timedelta(minutes=config.interval_minutes)
         await db.commit()
         await db.refresh(config)
+        _cache_reset_config(config)
         
         await _reset_core(core, request, db)
         
@@ -269,84 +311,124 @@ async def _reset_core(core: str, app_or_request, db: AsyncSession):
     else:
         app = app_or_request
     
-    result = await db.execute(select(Tunnel).where(Tunnel.core == core, Tunnel.status == "active"))
-    active_tunnels = result.scalars().all()
+    # Load nodes once up front instead of querying per tunnel
+    result = await db.execute(select(Node))
+    all_nodes = result.scalars().all()
+    nodes_by_id = {n.id: n for n in all_nodes}
+    iran_nodes = [n for n in all_nodes if n.role == "iran"]
+    foreign_nodes = [n for n in all_nodes if n.role == "foreign"]
     
-    client = NodeClient()
+    # Resolve nodes and backfill missing api_address values up front so the
+    # whole reset needs a single commit and tasks never share the session
+    resets = []
+    nodes_touched = False
+    tunnel_stream = await db.stream_scalars(
+        select(Tunnel)
+        .where(Tunnel.core == core, Tunnel.status == "active")
+        .execution_options(yield_per=TUNNEL_FETCH_BATCH)
+    )
+    async for tunnel in tunnel_stream:
+        iran_node, foreign_node = _resolve_tunnel_nodes(tunnel, nodes_by_id, iran_nodes, foreign_nodes)
+        if not foreign_node or not iran_node:
+            logger.warning(f"Tunnel {tunnel.id}: Missing foreign or iran node, skipping reset")
+            continue
+        if _ensure_api_address(iran_node):
+            nodes_touched = True
+        if _ensure_api_address(foreign_node):
+            nodes_touched = True
+        resets.append((tunnel, iran_node, foreign_node))
     
-    for tunnel in active_tunnels:
-        try:
+    if nodes_touched:
+        await db.commit()
+    
+    client = node_client
+    
+    # Cap concurrent resets so nodes are not flooded with apply requests
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_RESETS)
+    
+    async def limited(tunnel: Tunnel, iran_node: Node, foreign_node: Node):
+        async with semaphore:
+            await _reset_one_tunnel(core, tunnel, iran_node, foreign_node, client)
+    
+    await asyncio.gather(*(limited(*r) for r in resets), return_exceptions=True)
+
+
+def _resolve_tunnel_nodes(
+    tunnel: Tunnel,
+    nodes_by_id: Dict[str, Node],
+    iran_nodes: List[Node],
+    foreign_nodes: List[Node]
+) -> Tuple[Optional[Node], Optional[Node]]:
+    """Pick the (iran, foreign) node pair a tunnel should be reset on"""
+    iran_node = None
+    foreign_node = None
+    
+    if tunnel.node_id:
+        iran_node = nodes_by_id.get(tunnel.node_id)
+        if iran_node and iran_node.role != "iran":
+            foreign_node = iran_node
             iran_node = None
-            foreign_node = None
-            
-            if tunnel.node_id:
-                result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-                iran_node = result.scalar_one_or_none()
-                if iran_node and iran_node.node_metadata.get("role") != "iran":
-                    foreign_node = iran_node
-                    iran_node = None
-            
-            if not foreign_node:
-                result = await db.execute(select(Node))
-                all_nodes = result.scalars().all()
-                foreign_nodes = [n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "foreign"]
-                if foreign_nodes:
-                    foreign_node = foreign_nodes[0]
-            
-            if not iran_node:
-                if tunnel.node_id:
-                    result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-                    iran_node = result.scalar_one_or_none()
-                if not iran_node:
-                    result = await db.execute(select(Node))
-                    all_nodes = result.scalars().all()
-                    iran_nodes = [n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "iran"]
-                    if iran_nodes:
-                        iran_node = iran_nodes[0]
-            
-            if not foreign_node or not iran_node:
-                logger.warning(f"Tunnel {tunnel.id}: Missing foreign or iran node, skipping reset")
-                continue
-            
-            server_spec = tunnel.spec.copy() if tunnel.spec else {}
-            server_spec["mode"] = "server"
-            
-            client_spec = tunnel.spec.copy() if tunnel.spec else {}
-            client_spec["mode"] = "client"
-            
-            if core == "frp":
-                bind_port = server_spec.get("bind_port", 7000)
-                token = server_spec.get("token")
-                server_spec["bind_port"] = bind_port
-                if token:
-                    server_spec["token"] = token
-                
-                iran_node_ip = iran_node.node_metadata.get("ip_address")
-                if not iran_node_ip:
-                    logger.warning(f"Tunnel {tunnel.id}: Iran node has no IP address, skipping")
-                    continue
-                client_spec["server_addr"] = iran_node_ip
-                client_spec["server_port"] = bind_port
-                if token:
-                    client_spec["token"] = token
-                tunnel_type = tunnel.type.lower() if tunnel.type else "tcp"
-                if tunnel_type not in ["tcp", "udp"]:
-                    tunnel_type = "tcp"
-                client_spec["type"] = tunnel_type
-                local_ip = client_spec.get("local_ip") or iran_node_ip
-                local_port = client_spec.get("local_port") or bind_port
-                client_spec["local_ip"] = local_ip
-                client_spec["local_port"] = local_port
-            else:
-                logger.warning(f"Tunnel {tunnel.id}: Unsupported core type {core}, skipping")
-                continue
-            
-            if not iran_node.node_metadata.get("api_address"):
-                iran_node.node_metadata["api_address"] = f"http://{iran_node.node_metadata.get('ip_address', iran_node.fingerprint)}:{iran_node.node_metadata.get('api_port', 8888)}"
-                await db.commit()
-            
-            logger.info(f"Restarting tunnel {tunnel.id}: applying server config to iran node {iran_node.id}")
-            server_response = await client.send_to_node(
+    
+    if not foreign_node and foreign_nodes:
+        foreign_node = foreign_nodes[0]
+    
+    if not iran_node:
+        if tunnel.node_id:
+            iran_node = nodes_by_id.get(tunnel.node_id)
+        if not iran_node and iran_nodes:
+            iran_node = iran_nodes[0]
+    
+    return iran_node, foreign_node
+
+
+def _ensure_api_address(node: Node) -> bool:
+    """Backfill api_address in node metadata, return True if it was changed"""
+    if node.node_metadata.get("api_address"):
+        return False
+    node.node_metadata["api_address"] = f"http://{node.node_metadata.get('ip_address', node.fingerprint)}:{node.node_metadata.get('api_port', 8888)}"
+    flag_modified(node, "node_metadata")
+    return True
+
+
+async def _reset_one_tunnel(
+    core: str,
+    tunnel: Tunnel,
+    iran_node: Node,
+    foreign_node: Node,
+    client: NodeClient
+):
+    """Restart a single tunnel by re-applying server and client configs"""
+    try:
+        if core != "frp":
+            logger.warning(f"Tunnel {tunnel.id}: Unsupported core type {core}, skipping")
+            return
+        
+        iran_node_ip = iran_node.ip_address
+        if not iran_node_ip:
+            logger.warning(f"Tunnel {tunnel.id}: Iran node has no IP address, skipping")
+            return
+        
+        base_spec = tunnel.spec or {}
+        bind_port = base_spec.get("bind_port", 7000)
+        tunnel_type = tunnel.type.lower() if tunnel.type else "tcp"
+        if tunnel_type not in ["tcp", "udp"]:
+            tunnel_type = "tcp"
+        
+        server_spec = {**base_spec, "mode": "server", "bind_port": bind_port}
+        client_spec = {
+            **base_spec,
+            "mode": "client",
+            "server_addr": iran_node_ip,
+            "server_port": bind_port,
+            "type": tunnel_type,
+            "local_ip": base_spec.get("local_ip") or iran_node_ip,
+            "local_port": base_spec.get("local_port") or bind_port,
+        }
+        
+        # Server and client target different hosts, so apply both at once
+        logger.info(f"Restarting tunnel {tunnel.id}: applying server config to iran node {iran_node.id} and client config to foreign node {foreign_node.id}")
+        server_response, client_response = await asyncio.gather(
+            client.send_to_node(
                 node_id=iran_node.id,
                 endpoint="/api/agent/tunnels/apply",
                 data={
@@ -355,19 +437,8 @@ async def _reset_core(core: str, app_or_request, db: AsyncSession):
                     "type": tunnel.type,
                     "spec": server_spec
                 }
-            )
-            
-            if server_response.get("status") == "error":
-                error_msg = server_response.get("message", "Unknown error from iran node")
-                logger.error(f"Failed to restart tunnel {tunnel.id} on iran node {iran_node.id}: {error_msg}")
-                continue
-            
-            if not foreign_node.node_metadata.get("api_address"):
-                foreign_node.node_metadata["api_address"] = f"http://{foreign_node.node_metadata.get('ip_address', foreign_node.fingerprint)}:{foreign_node.node_metadata.get('api_port', 8888)}"
-                await db.commit()
-            
-            logger.info(f"Restarting tunnel {tunnel.id}: applying client config to foreign node {foreign_node.id}")
-            client_response = await client.send_to_node(
+            ),
+            client.send_to_node(
                 node_id=foreign_node.id,
                 endpoint="/api/agent/tunnels/apply",
                 data={
@@ -376,15 +447,25 @@ async def _reset_core(core: str, app_or_request, db: AsyncSession):
                     "type": tunnel.type,
                     "spec": client_spec
                 }
-            )
-            
-            if client_response.get("status") == "error":
-                error_msg = client_response.get("message", "Unknown error from foreign node")
-                logger.error(f"Failed to restart tunnel {tunnel.id} on foreign node {foreign_node.id}: {error_msg}")
-            else:
-                logger.info(f"Successfully restarted tunnel {tunnel.id} on both nodes")
-            
-            await asyncio.sleep(0.5)
-        except Exception as e:
-            logger.error(f"Failed to restart tunnel {tunnel.id}: {e}", exc_info=True)
-
+            ),
+            return_exceptions=True
+        )
+        
+        if isinstance(server_response, Exception):
+            server_response = {"status": "error", "message": str(server_response)}
+        if isinstance(client_response, Exception):
+            client_response = {"status": "error", "message": str(client_response)}
+        
+        server_failed = server_response.get("status") == "error"
+        client_failed = client_response.get("status") == "error"
+        
+        if server_failed:
+            error_msg = server_response.get("message", "Unknown error from iran node")
+            logger.error(f"Failed to restart tunnel {tunnel.id} on iran node {iran_node.id}: {error_msg}")
+        if client_failed:
+            error_msg = client_response.get("message", "Unknown error from foreign node")
+            logger.error(f"Failed to restart tunnel {tunnel.id} on foreign node {foreign_node.id}: {error_msg}")
+        if not server_failed and not client_failed:
+            logger.info(f"Successfully restarted tunnel {tunnel.id} on both nodes")
+    except Exception as e:
+        logger.error(f"Failed to restart tunnel {tunnel.id}: {e}", exc_info=True)
@@ -1,31 +1,153 @@
 """WireGuard Mesh API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from sqlalchemy import select, delete, update, bindparam
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional
 import logging
+import asyncio
+import ipaddress
+import orjson
+import zlib
 from datetime import datetime
+from functools import lru_cache
 
-from app.database import get_db
-from app.models import WireGuardMesh, Node, Tunnel
-from app.wireguard_mesh_manager import wireguard_mesh_manager
-from app.node_client import NodeClient
+from app.database import AsyncSessionLocal, get_db
+from app.models import WireGuardMesh, Node, Tunnel, generate_uuid
+from app.wireguard_mesh_manager import MeshNode, wireguard_mesh_manager
+from app.node_client import node_client
 from app.ipam_manager import ipam_manager
+from app.routers.tunnels import prepare_frp_spec_for_node
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Upper bound on concurrent agent RPCs per apply phase
+MAX_PARALLEL_NODE_APPLIES = 16
+
+# Statements shared by the mesh endpoints; expanding IN keeps one compiled form for any node count
+_NODES_WITH_METADATA_STMT = select(Node.id, Node.name, Node.role, Node.ip_address, Node.node_metadata).where(
+    Node.id.in_(bindparam("ids", expanding=True))
+)
+_NODE_NAMES_STMT = select(Node.id, Node.name).where(Node.id.in_(bindparam("ids", expanding=True)))
+_NODE_IDS_STMT = select(Node.id).where(Node.id.in_(bindparam("ids", expanding=True)))
+
+
+@lru_cache(maxsize=4096)
+def _port_hash(key: str) -> int:
+    """Deterministic non-cryptographic hash used to derive mesh ports"""
+    return zlib.crc32(key.encode())
+
+
+def _nodes_of(mesh_config_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Return the per-node configs stored in a mesh's mesh_config"""
+    if not mesh_config_data:
+        return {}
+    return mesh_config_data.get("nodes") or {}
+
+
+async def normalize_legacy_mesh_configs(db: AsyncSession):
+    """Wrap legacy mesh configs (a bare node_id -> config dict) in the current schema"""
+    result = await db.execute(select(WireGuardMesh))
+    migrated = 0
+    for mesh in result.scalars().all():
+        mesh_config_data = mesh.mesh_config
+        if not isinstance(mesh_config_data, dict) or not mesh_config_data:
+            continue
+        if "nodes" in mesh_config_data or "transport" in mesh_config_data:
+            continue
+        mesh.mesh_config = {
+            "transport": "udp",
+            "nodes": mesh_config_data
+        }
+        migrated += 1
+    
+    if migrated:
+        await db.commit()
+        logger.info(f"Normalized {migrated} legacy mesh config(s)")
+
+
+async def backfill_tunnel_mesh_ids(db: AsyncSession):
+    """Tag mesh tunnels created before Tunnel.mesh_id existed, matching them by name prefix"""
+    result = await db.execute(select(WireGuardMesh.id))
+    tagged = 0
+    for mesh_id in result.scalars().all():
+        update_result = await db.execute(
+            update(Tunnel)
+            .where(Tunnel.mesh_id.is_(None), Tunnel.name.like(f"wg-mesh-{mesh_id[:8]}%"))
+            .values(mesh_id=mesh_id)
+        )
+        tagged += update_result.rowcount or 0
+    if tagged:
+        await db.commit()
+        logger.info(f"Tagged {tagged} legacy mesh tunnel(s) with their mesh_id")
+
+
+def _build_peer_endpoints(
+    mesh_configs: Dict[str, Any],
+    nodes_by_id: Dict[str, Any],
+    iran_nodes: List[tuple],
+    foreign_node_remote_ports: Dict[str, Dict[str, Dict[str, int]]],
+    transports_to_create: List[str],
+    shared_wg_port: int
+) -> Dict[str, Dict[str, str]]:
+    """Map each mesh peer to its WireGuard endpoint per transport"""
+    peer_endpoints = {}  # {peer_id: {transport: endpoint, ...}, ...}
+    
+    # Foreign peers are reached through the first Iran server, resolve it once for every node
+    first_iran_id, first_iran_ip = None, None
+    if iran_nodes:
+        first_iran_id, first_iran_node, _ = iran_nodes[0]
+        first_iran_ip = first_iran_node.ip_address
+    
+    for peer_id in mesh_configs:
+        peer_node = nodes_by_id.get(peer_id)
+        if not peer_node:
+            continue
+        
+        peer_role = peer_node.role or "iran"
+        peer_ip = peer_node.ip_address
+        
+        # Determine endpoint for this peer
+        peer_endpoint_map = {}
+        
+        if peer_role == "iran":
+            # Peer is Iran node: Use direct IP address with shared_wg_port (Iran nodes connect directly, no FRP)
+            if peer_ip:
+                for trans in transports_to_create:
+                    peer_endpoint_map[trans] = f"{peer_ip}:{shared_wg_port}"
+                logger.info(f"Iran peer {peer_id}: using direct IP {peer_ip}:{shared_wg_port} (no FRP)")
+            else:
+                logger.warning(f"Iran peer {peer_id} has no IP address")
+        else:
+            # Peer is Foreign node: Use Foreign node's unique remote_port on an Iran server
+            # Each Foreign node has a unique remote_port on each Iran server for Foreign-to-Foreign connectivity
+            # We can use any Iran server's IP with the Foreign node's unique remote_port
+            if peer_id in foreign_node_remote_ports and iran_nodes:
+                if first_iran_ip and first_iran_id in foreign_node_remote_ports[peer_id]:
+                    # Build endpoint map with Foreign peer's unique remote_ports
+                    for trans in transports_to_create:
+                        if trans in foreign_node_remote_ports[peer_id][first_iran_id]:
+                            unique_remote_port = foreign_node_remote_ports[peer_id][first_iran_id][trans]
+                            peer_endpoint_map[trans] = f"{first_iran_ip}:{unique_remote_port}"
+                    logger.info(f"Foreign peer {peer_id}: using Foreign's unique remote_port on Iran server {first_iran_id}")
+        
+        if peer_endpoint_map:
+            peer_endpoints[peer_id] = peer_endpoint_map
+    
+    return peer_endpoints
+
 
 class MeshCreate(BaseModel):
     name: str
-    node_ids: List[str]
+    node_ids: List[str] = Field(..., min_length=2)  # At least 2 nodes required for mesh
     lan_subnets: Dict[str, str]
     overlay_subnet: Optional[str] = None
-    topology: str = "full-mesh"
+    topology: Literal["full-mesh", "hub-spoke"] = "full-mesh"
     mtu: int = 1280
-    transport: str = "both"
-    wireguard_port: Optional[int] = None  # Custom WireGuard port (local_port and remote_port will use this)
+    transport: Literal["tcp", "udp", "both"] = "both"
+    wireguard_port: Optional[int] = Field(default=None, ge=1, le=65535)  # Custom WireGuard port (local_port and remote_port will use this)
 
 
 class MeshResponse(BaseModel):
@@ -38,6 +160,9 @@ class MeshResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     mesh_config: Dict[str, Any]
+    
+    class Config:
+        from_attributes = True
 
 
 @router.post("/create", response_model=MeshResponse)
@@ -46,21 +171,11 @@ async def create_mesh(
     request: Request,
     db: AsyncSession = Depends(get_db)
 ):
-    """Create a new WireGuard mesh"""
-    if mesh.topology not in ["full-mesh", "hub-spoke"]:
-        raise HTTPException(status_code=400, detail="Topology must be 'full-mesh' or 'hub-spoke'")
-    
-    if mesh.transport not in ["tcp", "udp", "both"]:
-        raise HTTPException(status_code=400, detail="Transport must be 'tcp', 'udp', or 'both'")
-    
-    if len(mesh.node_ids) < 2:
-        raise HTTPException(status_code=400, detail="At least 2 nodes required for mesh")
-    
-    # Validate wireguard_port if provided
-    if mesh.wireguard_port is not None:
-        if not (1 <= mesh.wireguard_port <= 65535):
-            raise HTTPException(status_code=400, detail="wireguard_port must be between 1 and 65535")
+    """Create a new WireGuard mesh
     
+    Topology, transport, node count and wireguard_port range are checked by
+    MeshCreate before the handler runs.
+    """
     nodes_result = await db.execute(
         select(Node).where(Node.id.in_(mesh.node_ids))
     )
@@ -69,19 +184,19 @@ async def create_mesh(
     if len(nodes) != len(mesh.node_ids):
         raise HTTPException(status_code=404, detail="One or more nodes not found")
     
-    pool = await ipam_manager.get_pool(db)
-    if not pool:
+    pool_cidr = await ipam_manager.get_pool_cidr(db)
+    if not pool_cidr:
         raise HTTPException(
             status_code=400,
             detail="No overlay IP pool configured. Please create an overlay pool first."
         )
     
-    overlay_subnet = mesh.overlay_subnet or pool.cidr
+    overlay_subnet = mesh.overlay_subnet or pool_cidr
     
-    if overlay_subnet != pool.cidr:
+    if overlay_subnet != pool_cidr:
         raise HTTPException(
             status_code=400,
-            detail=f"Overlay subnet must match IPAM pool CIDR: {pool.cidr}"
+            detail=f"Overlay subnet must match IPAM pool CIDR: {pool_cidr}"
         )
     
     # Helper function to parse and validate comma-separated LAN subnets
@@ -90,7 +205,6 @@ async def create_mesh(
         if not subnet_string or not subnet_string.strip():
             return []
         
-        import ipaddress
         subnets = []
         for subnet in subnet_string.split(','):
             subnet = subnet.strip()
@@ -106,34 +220,42 @@ async def create_mesh(
                     )
         return subnets
     
+    # Validate every LAN subnet before allocating any overlay IPs
+    node_lan_subnets = {node.id: parse_lan_subnets(mesh.lan_subnets.get(node.id, "")) for node in nodes}
+    
     node_configs = []
-    node_ipam_ips = {}
+    node_ipam_ips = await ipam_manager.get_node_ips(db, [node.id for node in nodes])
+    
+    missing_ip_node_ids = [node.id for node in nodes if node.id not in node_ipam_ips]
+    if missing_ip_node_ids:
+        node_ipam_ips.update(await ipam_manager.allocate_ips(db, missing_ip_node_ids))
     
     for node in nodes:
         node_id = node.id
-        lan_subnet_string = mesh.lan_subnets.get(node_id, "")
-        lan_subnets_list = parse_lan_subnets(lan_subnet_string)
+        lan_subnets_list = node_lan_subnets[node_id]
         
-        overlay_ip = await ipam_manager.get_node_ip(db, node_id)
+        overlay_ip = node_ipam_ips.get(node_id)
         if not overlay_ip:
-            overlay_ip = await ipam_manager.allocate_ip(db, node_id)
-            if not overlay_ip:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Failed to allocate overlay IP for node {node.name}. Pool may be exhausted."
-                )
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to allocate overlay IP for node {node.name}. Pool may be exhausted."
+            )
         
-        node_ipam_ips[node_id] = overlay_ip
-        node_configs.append({
-            "node_id": node_id,
-            "name": node.name,
-            "lan_subnet": lan_subnets_list,  # Now a list instead of string
-            "overlay_ip": overlay_ip
-        })
+        node_configs.append(MeshNode(
+            node_id=node_id,
+            name=node.name,
+            lan_subnet=lan_subnets_list,
+            overlay_ip=overlay_ip
+        ))
+    
+    # Assign the ID up front so the mesh config is generated once with the real mesh_id
+    mesh_id = generate_uuid()
     
     try:
-        mesh_configs = wireguard_mesh_manager.create_mesh_config(
-            mesh_id="",  # Will be set after DB insert
+        # Keypair generation is CPU work for every node, keep it off the event loop
+        mesh_configs = await asyncio.to_thread(
+            wireguard_mesh_manager.create_mesh_config,
+            mesh_id=mesh_id,
             nodes=node_configs,
             overlay_subnet=overlay_subnet,
             topology=mesh.topology,
@@ -150,6 +272,7 @@ async def create_mesh(
     }
     
     db_mesh = WireGuardMesh(
+        id=mesh_id,
         name=mesh.name,
         topology=mesh.topology,
         overlay_subnet=overlay_subnet,
@@ -158,24 +281,9 @@ async def create_mesh(
         mesh_config=mesh_config_data
     )
     db.add(db_mesh)
+    # Column defaults are applied client-side on flush and the session keeps
+    # attributes after commit, so no refresh round-trip is needed
     await db.commit()
-    await db.refresh(db_mesh)
-    
-    mesh_configs = wireguard_mesh_manager.create_mesh_config(
-        mesh_id=db_mesh.id,
-        nodes=node_configs,
-        overlay_subnet=overlay_subnet,
-        topology=mesh.topology,
-        mtu=mesh.mtu
-    )
-    mesh_config_data = {
-        "transport": mesh.transport,
-        "wireguard_port": mesh.wireguard_port,  # Store custom WireGuard port
-        "nodes": mesh_configs
-    }
-    db_mesh.mesh_config = mesh_config_data
-    await db.commit()
-    await db.refresh(db_mesh)
     
     return db_mesh
 
@@ -184,13 +292,48 @@ async def create_mesh(
 async def apply_mesh(
     mesh_id: str,
     request: Request,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     db: AsyncSession = Depends(get_db)
 ):
-    """Apply mesh configuration to all nodes"""
-    result = await db.execute(
-        select(WireGuardMesh).where(WireGuardMesh.id == mesh_id)
-    )
-    mesh = result.scalar_one_or_none()
+    """Apply mesh configuration to all nodes
+    
+    With background=true the apply runs after the response is sent; poll the mesh
+    status until it leaves "applying".
+    """
+    if not background:
+        return await _apply_mesh_impl(mesh_id, request, db)
+    
+    mesh = await db.get(WireGuardMesh, mesh_id)
+    
+    if not mesh:
+        raise HTTPException(status_code=404, detail="Mesh not found")
+    
+    mesh.status = "applying"
+    await db.commit()
+    
+    background_tasks.add_task(_apply_mesh_in_background, mesh_id, request)
+    return {"status": "applying", "message": "Mesh apply started"}
+
+
+async def _apply_mesh_in_background(mesh_id: str, request: Request):
+    """Run a mesh apply after the response is sent and record failures on the mesh"""
+    async with AsyncSessionLocal() as db:
+        try:
+            await _apply_mesh_impl(mesh_id, request, db)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Background apply of mesh {mesh_id} failed: {detail}", exc_info=not isinstance(e, HTTPException))
+            await db.rollback()
+            await db.execute(
+                update(WireGuardMesh).where(WireGuardMesh.id == mesh_id).values(status="error")
+            )
+            await db.commit()
+
+
+async def _apply_mesh_impl(mesh_id: str, request: Request, db: AsyncSession):
+    """Push tunnels and WireGuard configs for a mesh to its nodes"""
+    mesh = await db.get(WireGuardMesh, mesh_id)
     
     if not mesh:
         raise HTTPException(status_code=404, detail="Mesh not found")
@@ -201,37 +344,34 @@ async def apply_mesh(
     
     transport = mesh_config_data.get("transport", "udp")
     wireguard_port = mesh_config_data.get("wireguard_port")  # Get custom WireGuard port if set
-    mesh_configs = mesh_config_data.get("nodes", {})
+    mesh_configs = _nodes_of(mesh_config_data)
     
     if not mesh_configs:
         raise HTTPException(status_code=400, detail="Mesh node configuration not found")
     
     logger.info(f"Applying mesh {mesh_id} with transport={transport}, nodes={list(mesh_configs.keys())}")
     
-    node_client = NodeClient()
-    frp_endpoints = {}
+    # Only id, name and metadata are needed; rows expose them as attributes like Node does
+    nodes_result = await db.execute(_NODES_WITH_METADATA_STMT, {"ids": list(mesh_configs.keys())})
+    nodes_by_id = {row.id: row for row in nodes_result.all()}
+    
+    # Read overlay IPs up front too: Step 1 commits before any agent call, so no
+    # transaction (and pooled connection) stays open while nodes are being contacted
+    overlay_ips = await ipam_manager.get_node_ips(db, list(mesh_configs.keys()))
     
     # Separate Iran and Foreign nodes
     iran_nodes = []
     foreign_nodes = []
     
     for node_id, node_config in mesh_configs.items():
-        node_result = await db.execute(
-            select(Node).where(Node.id == node_id)
-        )
-        node = node_result.scalar_one_or_none()
+        node = nodes_by_id.get(node_id)
         if not node:
             logger.warning(f"Node {node_id} not found, skipping")
             continue
         
-        node_role = node.node_metadata.get("role", "iran")
-        logger.info(f"Node {node_id} ({node.name}) has role: {node_role}")
-        if node_role == "iran":
-            iran_nodes.append((node_id, node, node_config))
-            logger.info(f"Added node {node_id} to Iran nodes list")
-        else:
-            foreign_nodes.append((node_id, node, node_config))
-            logger.info(f"Added node {node_id} to Foreign nodes list")
+        node_role = node.role or "iran"
+        logger.debug(f"Node {node_id} ({node.name}) has role: {node_role}")
+        (iran_nodes if node_role == "iran" else foreign_nodes).append((node_id, node, node_config))
     
     if not iran_nodes:
         raise HTTPException(
@@ -241,117 +381,134 @@ async def apply_mesh(
     
     logger.info(f"Full mesh setup: {len(iran_nodes)} Iran node(s), {len(foreign_nodes)} Foreign node(s)")
     
-    # Clean up old mesh tunnels
-    old_tunnels = await db.execute(
-        select(Tunnel).where(
-            Tunnel.name.like(f"wg-mesh-{mesh_id[:8]}%")
-        )
+    # Clean up old mesh tunnels: drop the rows and get back exactly what the agent removes need
+    old_tunnels_result = await db.execute(
+        delete(Tunnel).where(Tunnel.mesh_id == mesh_id).returning(Tunnel.id, Tunnel.node_id)
     )
-    for old_tunnel in old_tunnels.scalars().all():
-        logger.info(f"Deleting old tunnel {old_tunnel.id}")
+    old_tunnels = old_tunnels_result.all()
+    if old_tunnels:
+        # Commit before the agent calls so the write lock is not held across network I/O
+        await db.commit()
+    
+    async def remove_old_tunnel(tunnel_id: str, tunnel_node_id: str):
+        logger.info(f"Deleting old tunnel {tunnel_id}")
         try:
-            if old_tunnel.node_id:
-                await node_client.send_to_node(
-                    node_id=old_tunnel.node_id,
-                    endpoint="/api/agent/tunnels/remove",
-                    data={"tunnel_id": old_tunnel.id}
-                )
+            await node_client.send_to_node(
+                node_id=tunnel_node_id,
+                endpoint="/api/agent/tunnels/remove",
+                data={"tunnel_id": tunnel_id}
+            )
         except Exception as e:
             logger.warning(f"Error removing old tunnel: {e}")
-        await db.delete(old_tunnel)
-    await db.commit()
     
-    # Determine transports
-    if transport == "both":
-        transports_to_create = ["tcp", "udp"]
-    else:
-        transports_to_create = [transport]
-    
-    import hashlib
-    from app.routers.tunnels import prepare_frp_spec_for_node
-    
-    # Step 1: Create FRP servers on ALL Iran nodes
-    # Map: iran_node_id -> transport -> endpoint
-    iran_node_endpoints = {}  # {iran_node_id: {transport: "ip:port", ...}, ...}
-    
-    # Generate shared WireGuard port (consistent across all Iran nodes for Foreign node compatibility)
-    if wireguard_port is not None:
-        shared_wg_port = wireguard_port
-        logger.info(f"Using custom WireGuard port {shared_wg_port} for all Iran nodes")
-    else:
-        # Generate a single port based on mesh_id (not per-node) for consistency
-        port_hash = int(hashlib.md5(f"{mesh_id}-wg-port".encode()).hexdigest()[:8], 16)
-        shared_wg_port = 17000 + (port_hash % 1000)
-        logger.info(f"Using generated shared WireGuard port {shared_wg_port} for all Iran nodes")
-    
-    for iran_node_id, iran_node, _ in iran_nodes:
-        iran_node_ip = iran_node.node_metadata.get("ip_address")
-        if not iran_node_ip:
-            logger.warning(f"Iran node {iran_node_id} has no IP address, skipping")
-            continue
+    # Agent removes run while Step 1 builds and stores the new server rows; the finally
+    # awaits them before any new tunnel is applied, and keeps them from outliving a failure
+    old_tunnel_removal = asyncio.gather(*(
+        remove_old_tunnel(old_tunnel.id, old_tunnel.node_id)
+        for old_tunnel in old_tunnels if old_tunnel.node_id
+    ))
+    
+    try:
+        # Every mesh tunnel name starts with the same prefix, build it once for the loops below
+        name_prefix = f"wg-mesh-{mesh_id[:8]}"
+        
+        # Determine transports
+        if transport == "both":
+            transports_to_create = ["tcp", "udp"]
+        else:
+            transports_to_create = [transport]
+        
+        # Step 1: Create FRP servers on ALL Iran nodes
+        # Map: iran_node_id -> transport -> endpoint
+        iran_node_endpoints = {}  # {iran_node_id: {transport: "ip:port", ...}, ...}
+        
+        # Generate shared WireGuard port (consistent across all Iran nodes for Foreign node compatibility)
+        if wireguard_port is not None:
+            shared_wg_port = wireguard_port
+            logger.info(f"Using custom WireGuard port {shared_wg_port} for all Iran nodes")
+        else:
+            # Generate a single port based on mesh_id (not per-node) for consistency
+            port_hash = _port_hash(f"{mesh_id}-wg-port")
+            shared_wg_port = 17000 + (port_hash % 1000)
+            logger.info(f"Using generated shared WireGuard port {shared_wg_port} for all Iran nodes")
+        
+        server_jobs = []  # [(iran_node_id, iran_node, iran_node_ip, transport, bind_port, tunnel), ...]
+        iran_bind_ports = {}  # {(iran_node_id, transport): bind_port}, reused by the FRP clients in Step 2
+        for iran_node_id, iran_node, _ in iran_nodes:
+            iran_node_ip = iran_node.ip_address
+            if not iran_node_ip:
+                logger.warning(f"Iran node {iran_node_id} has no IP address, skipping")
+                continue
         
-        iran_node_endpoints[iran_node_id] = {}
+            iran_node_endpoints[iran_node_id] = {}
         
-        for trans in transports_to_create:
-            # Generate unique bind_port for each Iran node (FRP server port)
-            port_hash = int(hashlib.md5(f"{mesh_id}-{iran_node_id}-{trans}".encode()).hexdigest()[:8], 16)
-            bind_port = 7000 + (port_hash % 1000)  # FRP bind_port remains random
+            for trans in transports_to_create:
+                # Generate unique bind_port for each Iran node (FRP server port)
+                port_hash = _port_hash(f"{mesh_id}-{iran_node_id}-{trans}")
+                bind_port = 7000 + (port_hash % 1000)  # FRP bind_port remains random
+                iran_bind_ports[(iran_node_id, trans)] = bind_port
             
-            # Use shared WireGuard port for all Iran nodes
-            wg_port = shared_wg_port
-            logger.info(f"Iran node {iran_node_id}: bind_port={bind_port}, wg_port={wg_port}")
+                # Use shared WireGuard port for all Iran nodes
+                wg_port = shared_wg_port
+                logger.info(f"Iran node {iran_node_id}: bind_port={bind_port}, wg_port={wg_port}")
             
-            tunnel_name = f"wg-mesh-{mesh_id[:8]}-{iran_node_id[:8]}-{trans}-server"
+                tunnel_name = f"{name_prefix}-{iran_node_id[:8]}-{trans}-server"
             
-            # Create tunnel record
-            tunnel = Tunnel(
-                name=tunnel_name,
-                core="frp",
-                type=trans,
+                # Create tunnel record
+                tunnel = Tunnel(
+                    name=tunnel_name,
+                    mesh_id=mesh_id,
+                    core="frp",
+                    type=trans,
+                    node_id=iran_node_id,
+                    spec={
+                        "bind_port": bind_port,
+                        "remote_port": wg_port,
+                        "local_port": wg_port,
+                        "local_ip": "127.0.0.1",
+                    },
+                    status="pending"
+                )
+                server_jobs.append((iran_node_id, iran_node, iran_node_ip, trans, bind_port, tunnel))
+        
+        # Insert all server tunnel records in one transaction so the node calls can run concurrently
+        db.add_all([job[-1] for job in server_jobs])
+        await db.commit()
+    finally:
+        await old_tunnel_removal
+    
+    async def apply_frp_server(iran_node_id: str, iran_node: Node, iran_node_ip: str, trans: str, bind_port: int, tunnel: Tunnel):
+        # Apply FRP server to Iran node
+        try:
+            server_spec = {"bind_port": bind_port}
+            server_spec_prepared = prepare_frp_spec_for_node(server_spec, iran_node, request)
+            server_spec_prepared["mode"] = "server"
+            
+            response = await node_client.send_to_node(
                 node_id=iran_node_id,
-                spec={
-                    "bind_port": bind_port,
-                    "remote_port": wg_port,
-                    "local_port": wg_port,
-                    "local_ip": "127.0.0.1",
-                },
-                status="pending"
+                endpoint="/api/agent/tunnels/apply",
+                data={
+                    "tunnel_id": tunnel.id,
+                    "core": "frp",
+                    "type": trans,
+                    "spec": server_spec_prepared
+                }
             )
-            db.add(tunnel)
-            await db.commit()
-            await db.refresh(tunnel)
+            if response.get("status") == "error":
+                raise RuntimeError(f"Failed to apply FRP server: {response.get('message')}")
             
-            # Apply FRP server to Iran node
-            try:
-                server_spec = {"bind_port": bind_port}
-                server_spec_prepared = prepare_frp_spec_for_node(server_spec, iran_node, request)
-                server_spec_prepared["mode"] = "server"
-                
-                response = await node_client.send_to_node(
-                    node_id=iran_node_id,
-                    endpoint="/api/agent/tunnels/apply",
-                    data={
-                        "tunnel_id": tunnel.id,
-                        "core": "frp",
-                        "type": trans,
-                        "spec": server_spec_prepared
-                    }
-                )
-                if response.get("status") == "error":
-                    raise RuntimeError(f"Failed to apply FRP server: {response.get('message')}")
-                
-                tunnel.status = "active"
-                await db.commit()
-                
-                endpoint = f"{iran_node_ip}:{wg_port}"
-                iran_node_endpoints[iran_node_id][trans] = endpoint
-                logger.info(f"Created FRP {trans} server on Iran node {iran_node_id}: {endpoint}")
-            except Exception as e:
-                logger.error(f"Failed to create FRP server on Iran node {iran_node_id}: {e}", exc_info=True)
-                tunnel.status = "error"
-                tunnel.error_message = str(e)
-                await db.commit()
-                continue
+            tunnel.status = "active"
+            
+            endpoint = f"{iran_node_ip}:{shared_wg_port}"
+            iran_node_endpoints[iran_node_id][trans] = endpoint
+            logger.info(f"Created FRP {trans} server on Iran node {iran_node_id}: {endpoint}")
+        except Exception as e:
+            logger.error(f"Failed to create FRP server on Iran node {iran_node_id}: {e}", exc_info=True)
+            tunnel.status = "error"
+            tunnel.error_message = str(e)
+    
+    await asyncio.gather(*(apply_frp_server(*job) for job in server_jobs))
+    await db.commit()
     
     if not iran_node_endpoints:
         raise HTTPException(
@@ -368,15 +525,12 @@ async def apply_mesh(
     foreign_node_remote_ports = {}  # Only for Foreign nodes - enables Foreign-to-Foreign connectivity
     
     # Create FRP clients for Foreign nodes with unique remote_ports
+    client_jobs = []  # [(foreign_node_id, iran_node_id, transport, client_spec, tunnel), ...]
     for foreign_node_id, foreign_node, _ in foreign_nodes:
         foreign_node_remote_ports[foreign_node_id] = {}
         
         for iran_node_id, iran_node, _ in iran_nodes:
-            iran_node_ip = iran_node.node_metadata.get("ip_address")
-            if not iran_node_ip:
-                logger.warning(f"Iran node {iran_node_id} has no IP address, skipping")
-                continue
-            
+            # Iran nodes without an IP address never got a server endpoint in Step 1
             if iran_node_id not in iran_node_endpoints:
                 continue
             
@@ -386,163 +540,126 @@ async def apply_mesh(
                 if trans not in iran_node_endpoints[iran_node_id]:
                     continue
                 
-                # Get the Iran server's endpoint and ports
-                endpoint = iran_node_endpoints[iran_node_id][trans]
-                iran_ip, _ = endpoint.rsplit(":", 1)
+                # The server endpoint is just this Iran node's IP, no need to parse it back out
+                iran_ip = iran_node.ip_address
                 
-                # Calculate bind_port the same way as server (unique per Iran node)
-                port_hash = int(hashlib.md5(f"{mesh_id}-{iran_node_id}-{trans}".encode()).hexdigest()[:8], 16)
-                bind_port = 7000 + (port_hash % 1000)
+                # Connect to the bind_port Step 1 gave this Iran server
+                bind_port = iran_bind_ports[(iran_node_id, trans)]
                 
                 # Generate UNIQUE remote_port for each Foreign node on each Iran server
                 # This enables Foreign-to-Foreign connectivity (each Foreign node has unique endpoint)
-                remote_port_hash = int(hashlib.md5(f"{mesh_id}-{foreign_node_id}-{iran_node_id}-{trans}".encode()).hexdigest()[:8], 16)
+                remote_port_hash = _port_hash(f"{mesh_id}-{foreign_node_id}-{iran_node_id}-{trans}")
                 unique_remote_port = 18000 + (remote_port_hash % 1000)  # Different port range from shared_wg_port
                 foreign_node_remote_ports[foreign_node_id][iran_node_id][trans] = unique_remote_port
                 
                 # WireGuard listens on shared_wg_port (local_port), but remote_port is unique per Foreign node
                 local_port = shared_wg_port
                 
-                tunnel_name = f"wg-mesh-{mesh_id[:8]}-{foreign_node_id[:8]}-to-{iran_node_id[:8]}-{trans}-client"
+                tunnel_name = f"{name_prefix}-{foreign_node_id[:8]}-to-{iran_node_id[:8]}-{trans}-client"
+                
+                client_spec = {
+                    "mode": "client",
+                    "server_addr": iran_ip,
+                    "server_port": bind_port,
+                    "type": trans,
+                    "local_ip": "127.0.0.1",
+                    "local_port": local_port,
+                    "remote_port": unique_remote_port,  # Unique per Foreign node
+                }
                 
                 # Create tunnel record
                 tunnel = Tunnel(
                     name=tunnel_name,
+                    mesh_id=mesh_id,
                     core="frp",
                     type=trans,
                     node_id=foreign_node_id,
-                    spec={
-                        "mode": "client",
-                        "server_addr": iran_ip,
-                        "server_port": bind_port,
-                        "type": trans,
-                        "local_ip": "127.0.0.1",
-                        "local_port": local_port,
-                        "remote_port": unique_remote_port,  # Unique per Foreign node
-                    },
+                    spec=client_spec,  # Never mutated after this point, store and send the same dict
                     status="pending"
                 )
-                db.add(tunnel)
-                await db.commit()
-                await db.refresh(tunnel)
-                
-                # Apply FRP client to Foreign node
-                try:
-                    client_spec = {
-                        "mode": "client",
-                        "server_addr": iran_ip,
-                        "server_port": bind_port,
-                        "type": trans,
-                        "local_ip": "127.0.0.1",
-                        "local_port": local_port,
-                        "remote_port": unique_remote_port,  # Unique per Foreign node
-                    }
-                    
-                    response = await node_client.send_to_node(
-                        node_id=foreign_node_id,
-                        endpoint="/api/agent/tunnels/apply",
-                        data={
-                            "tunnel_id": tunnel.id,
-                            "core": "frp",
-                            "type": trans,
-                            "spec": client_spec
-                        }
-                    )
-                    if response.get("status") == "error":
-                        raise RuntimeError(f"Failed to apply FRP client: {response.get('message')}")
-                    
-                    tunnel.status = "active"
-                    await db.commit()
-                    
-                    logger.info(f"Created FRP {trans} client on Foreign node {foreign_node_id} connecting to Iran {iran_node_id}: {iran_ip}:{bind_port} -> remote_port={unique_remote_port}, local_port={local_port}")
-                except Exception as e:
-                    logger.error(f"Failed to create FRP client on Foreign node {foreign_node_id} to Iran {iran_node_id}: {e}", exc_info=True)
-                    tunnel.status = "error"
-                    tunnel.error_message = str(e)
-                    await db.commit()
-                    continue
+                client_jobs.append((foreign_node_id, iran_node_id, trans, client_spec, tunnel))
+    
+    db.add_all([job[-1] for job in client_jobs])
+    await db.commit()
+    
+    async def apply_frp_client(foreign_node_id: str, iran_node_id: str, trans: str, client_spec: Dict[str, Any], tunnel: Tunnel):
+        # Apply FRP client to Foreign node
+        try:
+            response = await node_client.send_to_node(
+                node_id=foreign_node_id,
+                endpoint="/api/agent/tunnels/apply",
+                data={
+                    "tunnel_id": tunnel.id,
+                    "core": "frp",
+                    "type": trans,
+                    "spec": client_spec
+                }
+            )
+            if response.get("status") == "error":
+                raise RuntimeError(f"Failed to apply FRP client: {response.get('message')}")
+            
+            tunnel.status = "active"
+            
+            logger.info(f"Created FRP {trans} client on Foreign node {foreign_node_id} connecting to Iran {iran_node_id}: {client_spec['server_addr']}:{client_spec['server_port']} -> remote_port={client_spec['remote_port']}, local_port={client_spec['local_port']}")
+        except Exception as e:
+            logger.error(f"Failed to create FRP client on Foreign node {foreign_node_id} to Iran {iran_node_id}: {e}", exc_info=True)
+            tunnel.status = "error"
+            tunnel.error_message = str(e)
+    
+    await asyncio.gather(*(apply_frp_client(*job) for job in client_jobs))
+    await db.commit()
     
     # Iran nodes do NOT need FRP clients - they can connect directly via WireGuard
     # Since Iran nodes are not behind NAT, they can reach each other directly
     logger.info(f"Skipping FRP client creation for Iran nodes - they connect directly via WireGuard")
     
     # Step 3: Map endpoints for WireGuard peer configuration
-    # For each node, determine which endpoint to use for each peer:
+    # A peer's endpoint does not depend on which node connects to it:
     # - If peer is Iran node: Use that Iran node's FRP server endpoint directly (Iran nodes connect directly)
     # - If peer is Foreign node: Use any Iran server endpoint (Iran server forwards to Foreign node's local_port)
-    frp_endpoints = {}  # {node_id: {peer_id: {transport: endpoint, ...}, ...}, ...}
+    # so the map is built once and shared by every node's config; nodes only look up their own peers in it.
+    # No DB or agent calls are involved, it is plain dict work over the rows loaded above
+    peer_endpoints = _build_peer_endpoints(
+        mesh_configs,
+        nodes_by_id,
+        iran_nodes,
+        foreign_node_remote_ports,
+        transports_to_create,
+        shared_wg_port
+    )
     
-    for node_id, node_config in mesh_configs.items():
-        frp_endpoints[node_id] = {}
-        
-        node_result = await db.execute(
-            select(Node).where(Node.id == node_id)
-        )
-        node = node_result.scalar_one_or_none()
-        if not node:
-            continue
-        
-        # Get all peers for this node
-        for peer_id, peer_config in mesh_configs.items():
-            if peer_id == node_id:
-                continue
-            
-            peer_result = await db.execute(
-                select(Node).where(Node.id == peer_id)
-            )
-            peer_node = peer_result.scalar_one_or_none()
-            if not peer_node:
-                continue
-            
-            peer_role = peer_node.node_metadata.get("role", "iran")
-            peer_ip = peer_node.node_metadata.get("ip_address")
-            
-            # Determine endpoint for this peer
-            peer_endpoint_map = {}
-            
-            if peer_role == "iran":
-                # Peer is Iran node: Use direct IP address with shared_wg_port (Iran nodes connect directly, no FRP)
-                if peer_ip:
-                    for trans in transports_to_create:
-                        peer_endpoint_map[trans] = f"{peer_ip}:{shared_wg_port}"
-                    logger.info(f"Node {node_id} -> Iran peer {peer_id}: using direct IP {peer_ip}:{shared_wg_port} (no FRP)")
-                else:
-                    logger.warning(f"Iran peer {peer_id} has no IP address")
+    # Step 4: Apply WireGuard configuration to all nodes
+    apply_semaphore = asyncio.Semaphore(MAX_PARALLEL_NODE_APPLIES)
+    
+    async def apply_wireguard(node_id: str, node_role: str, listen_port: int, spec: Dict[str, Any]):
+        try:
+            logger.info(f"Applying WireGuard mesh to node {node_id} (role: {node_role}, listen_port: {listen_port})")
+            async with apply_semaphore:
+                response = await node_client.send_to_node(
+                    node_id=node_id,
+                    endpoint="/api/agent/mesh/apply",
+                    data={
+                        "mesh_id": mesh_id,
+                        "spec": spec
+                    }
+                )
+            if response.get("status") == "error":
+                error_msg = response.get("message", "Unknown error")
+                logger.error(f"Failed to apply mesh to node {node_id}: {error_msg}")
+                raise RuntimeError(f"Failed to apply WireGuard to node {node_id}: {error_msg}")
             else:
-                # Peer is Foreign node: Use Foreign node's unique remote_port on an Iran server
-                # Each Foreign node has a unique remote_port on each Iran server for Foreign-to-Foreign connectivity
-                # We can use any Iran server's IP with the Foreign node's unique remote_port
-                if peer_id in foreign_node_remote_ports and iran_nodes:
-                    first_iran_id, first_iran_node, _ = iran_nodes[0]
-                    first_iran_ip = first_iran_node.node_metadata.get("ip_address")
-                    if first_iran_ip and first_iran_id in foreign_node_remote_ports[peer_id]:
-                        # Build endpoint map with Foreign peer's unique remote_ports
-                        for trans in transports_to_create:
-                            if trans in foreign_node_remote_ports[peer_id][first_iran_id]:
-                                unique_remote_port = foreign_node_remote_ports[peer_id][first_iran_id][trans]
-                                peer_endpoint_map[trans] = f"{first_iran_ip}:{unique_remote_port}"
-                        logger.info(f"Node {node_id} -> Foreign peer {peer_id}: using Foreign's unique remote_port on Iran server {first_iran_id}")
-            
-            if peer_endpoint_map:
-                frp_endpoints[node_id][peer_id] = peer_endpoint_map
+                logger.info(f"Successfully applied WireGuard mesh to node {node_id}")
+        except Exception as e:
+            logger.error(f"Error applying mesh to node {node_id}: {e}", exc_info=True)
+            raise
     
-    # Step 4: Apply WireGuard configuration to all nodes
+    apply_tasks = []
     for node_id, node_config in mesh_configs.items():
-        if node_id not in frp_endpoints:
-            logger.warning(f"No FRP endpoints mapped for node {node_id}, skipping WireGuard config")
-            continue
-        
-        node_result = await db.execute(
-            select(Node).where(Node.id == node_id)
-        )
-        node = node_result.scalar_one_or_none()
+        node = nodes_by_id.get(node_id)
         if not node:
             continue
         
-        node_role = node.node_metadata.get("role", "iran")
-        
-        # Get peer endpoints for WireGuard config
-        peer_endpoints = frp_endpoints[node_id]
+        node_role = node.role or "iran"
         
         # Determine listen port for all nodes
         # All nodes (Iran and Foreign) should listen on the port where FRP forwards (local_port = shared_wg_port)
@@ -560,7 +677,7 @@ async def apply_mesh(
         routes = wireguard_mesh_manager.get_peer_routes(node_config)
         logger.info(f"Node {node_id}: Generated routes from peers: {routes}")
         
-        overlay_ip = await ipam_manager.get_node_ip(db, node_id)
+        overlay_ip = overlay_ips.get(node_id)
         if not overlay_ip:
             logger.warning(f"Node {node_id} has no IPAM overlay IP, mesh may not work correctly")
         
@@ -569,428 +686,79 @@ async def apply_mesh(
             "routes": routes,
             "overlay_ip": overlay_ip
         }
-        
-        try:
-            logger.info(f"Applying WireGuard mesh to node {node_id} (role: {node_role}, listen_port: {listen_port})")
-            response = await node_client.send_to_node(
-                node_id=node_id,
-                endpoint="/api/agent/mesh/apply",
-                data={
-                    "mesh_id": mesh_id,
-                    "spec": spec
-                }
-            )
-            if response.get("status") == "error":
-                error_msg = response.get("message", "Unknown error")
-                logger.error(f"Failed to apply mesh to node {node_id}: {error_msg}")
-                raise RuntimeError(f"Failed to apply WireGuard to node {node_id}: {error_msg}")
-            else:
-                logger.info(f"Successfully applied WireGuard mesh to node {node_id}")
-        except Exception as e:
-            logger.error(f"Error applying mesh to node {node_id}: {e}", exc_info=True)
-            raise
-    
-    mesh.status = "active"
-    await db.commit()
+        apply_tasks.append(apply_wireguard(node_id, node_role, listen_port, spec))
     
-    return {"status": "success", "message": "Mesh applied to all nodes"}
-
-
-async def _ensure_frp_server(
-    mesh_id: str,
-    node_id: str,
-    node: Node,
-    db: AsyncSession,
-    request: Request,
-    node_client: NodeClient,
-    transport: str = "udp"
-) -> Optional[str]:
-    """Ensure FRP server exists on Iran node, return endpoint"""
-    import hashlib
-    
-    if transport not in ["tcp", "udp"]:
-        transport = "udp"
-    
-    tunnel_name = f"wg-mesh-{mesh_id[:8]}-{transport}-{node_id[:8]}"
-    
-    existing_result = await db.execute(
-        select(Tunnel).where(
-            Tunnel.name == tunnel_name,
-            Tunnel.core == "frp",
-            Tunnel.type == transport,
-            Tunnel.node_id == node_id
+    # Nodes are independent, so push configs concurrently; nodes that succeeded stay applied
+    results = await asyncio.gather(*apply_tasks, return_exceptions=True)
+    failures = [str(result) for result in results if isinstance(result, Exception)]
+    if failures:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to apply WireGuard to {len(failures)} of {len(results)} node(s): " + "; ".join(failures)
         )
-    )
-    existing_tunnel = existing_result.scalar_one_or_none()
-    
-    node_ip = node.node_metadata.get("ip_address")
-    if not node_ip:
-        logger.warning(f"Node {node_id} has no IP address")
-        return None
-    
-    if existing_tunnel:
-        logger.info(f"Deleting existing FRP server tunnel {existing_tunnel.id} for node {node_id}")
-        try:
-            await node_client.send_to_node(
-                node_id=node_id,
-                endpoint="/api/agent/tunnels/remove",
-                data={"tunnel_id": existing_tunnel.id}
-            )
-        except Exception as e:
-            logger.warning(f"Error removing old tunnel from node {node_id}: {e}")
-        await db.delete(existing_tunnel)
-        await db.commit()
-    
-    # Generate unique bind_port for FRP server
-    port_hash = int(hashlib.md5(f"{mesh_id}-{node_id}-{transport}".encode()).hexdigest()[:8], 16)
-    bind_port = 7000 + (port_hash % 1000)
-    
-    # WireGuard port - remote_port and local_port must be the same for FRP tunnel to work
-    # This is where WireGuard will listen and where clients will connect
-    wg_port = 17000 + (port_hash % 1000)
-    
-    spec = {
-        "mode": "server",
-        "bind_port": bind_port,
-        "remote_port": wg_port,  # Store for WireGuard config
-        "local_port": wg_port,   # Same as remote_port (required for FRP)
-    }
-    
-    logger.info(f"Creating FRP server on Iran node: bind_port={bind_port}, transport={transport}, wg_port={wg_port} (remote_port=local_port={wg_port})")
     
-    tunnel = Tunnel(
-        name=tunnel_name,
-        core="frp",
-        type=transport,
-        node_id=node_id,
-        spec=spec,
-        status="active"
-    )
-    db.add(tunnel)
+    mesh.status = "active"
     await db.commit()
-    await db.refresh(tunnel)
-    
-    try:
-        logger.info(f"Applying FRP server tunnel {tunnel.id} to node {node_id} ({node_ip})")
-        response = await node_client.send_to_node(
-            node_id=node_id,
-            endpoint="/api/agent/tunnels/apply",
-            data={
-                "tunnel_id": tunnel.id,
-                "core": "frp",
-                "type": transport,
-                "spec": spec
-            }
-        )
-        if response.get("status") == "error":
-            logger.error(f"Failed to create FRP server tunnel {tunnel.id} on node {node_id}: {response.get('message')}")
-            return None
-        logger.info(f"Successfully applied FRP server tunnel {tunnel.id} to node {node_id}")
-    except Exception as e:
-        logger.error(f"Error creating FRP server tunnel {tunnel.id} on node {node_id}: {e}", exc_info=True)
-        return None
     
-    # Return endpoint: node_ip:wg_port (where WireGuard will connect)
-    # remote_port and local_port are the same (wg_port) for FRP tunnel to work
-    return f"{node_ip}:{wg_port}"
+    return {"status": "success", "message": "Mesh applied to all nodes"}
 
 
-async def _ensure_frp_client(
-    mesh_id: str,
-    foreign_node_id: str,
-    foreign_node: Node,
-    iran_node: Node,
-    iran_endpoint: str,
-    db: AsyncSession,
-    request: Request,
-    node_client: NodeClient,
-    transport: str = "udp"
-) -> None:
-    """Ensure FRP client exists on Foreign node connecting to Iran server"""
-    import hashlib
-    
-    if transport not in ["tcp", "udp"]:
-        transport = "udp"
-    
-    tunnel_name = f"wg-mesh-{mesh_id[:8]}-{transport}-{foreign_node_id[:8]}"
-    
-    existing_result = await db.execute(
-        select(Tunnel).where(
-            Tunnel.name == tunnel_name,
-            Tunnel.core == "frp",
-            Tunnel.type == transport,
-            Tunnel.node_id == foreign_node_id
-        )
-    )
-    existing_tunnel = existing_result.scalar_one_or_none()
+async def _load_mesh_status_context(db: AsyncSession, mesh_id: str):
+    """Load the mesh, node names and overlay IPs needed to report per-node status"""
+    mesh = await db.get(WireGuardMesh, mesh_id)
     
-    if existing_tunnel:
-        logger.info(f"Deleting existing FRP client tunnel {existing_tunnel.id} for Foreign node {foreign_node_id}")
-        try:
-            await node_client.send_to_node(
-                node_id=foreign_node_id,
-                endpoint="/api/agent/tunnels/remove",
-                data={"tunnel_id": existing_tunnel.id}
-            )
-        except Exception as e:
-            logger.warning(f"Error removing old tunnel from Foreign node {foreign_node_id}: {e}")
-        await db.delete(existing_tunnel)
-        await db.commit()
+    if not mesh:
+        raise HTTPException(status_code=404, detail="Mesh not found")
     
-    # Parse Iran endpoint to get IP and wg_port (remote_port = local_port for FRP to work)
-    if ":" in iran_endpoint:
-        iran_ip, wg_port_str = iran_endpoint.rsplit(":", 1)
-        try:
-            wg_port = int(wg_port_str)
-        except ValueError:
-            logger.error(f"Invalid wg_port in Iran endpoint: {wg_port_str}")
-            return
-    else:
-        logger.error(f"Invalid Iran endpoint format: {iran_endpoint}")
-        return
-    
-    # Calculate server_port the same way as in _ensure_frp_server
-    iran_port_hash = int(hashlib.md5(f"{mesh_id}-{iran_node.id}-{transport}".encode()).hexdigest()[:8], 16)
-    server_port = 7000 + (iran_port_hash % 1000)
-    
-    # For FRP tunnel to work: remote_port and local_port must be the same
-    # This is where WireGuard will listen on Iran and where Foreign's WireGuard will connect
-    spec = {
-        "mode": "client",
-        "transport": transport,
-        "server_addr": iran_ip,
-        "server_port": server_port,
-        "type": transport,
-        "local_ip": "127.0.0.1",
-        "local_port": wg_port,   # Same as remote_port (required for FRP)
-        "remote_port": wg_port,  # Same as local_port (required for FRP)
-    }
+    mesh_configs = _nodes_of(mesh.mesh_config)
     
-    logger.info(f"Creating FRP client on Foreign node {foreign_node_id} connecting to Iran {iran_ip}:{server_port}, remote_port=local_port={wg_port}")
+    nodes_result = await db.execute(_NODE_NAMES_STMT, {"ids": list(mesh_configs.keys())})
+    nodes_by_id = {row.id: row for row in nodes_result.all()}
     
-    tunnel = Tunnel(
-        name=tunnel_name,
-        core="frp",
-        type=transport,
-        node_id=foreign_node_id,
-        spec=spec,
-        status="active"
-    )
-    db.add(tunnel)
-    await db.commit()
-    await db.refresh(tunnel)
+    overlay_ips = await ipam_manager.get_node_ips(db, list(mesh_configs.keys()))
     
-    try:
-        logger.info(f"Applying FRP client tunnel {tunnel.id} to Foreign node {foreign_node_id}")
-        response = await node_client.send_to_node(
-            node_id=foreign_node_id,
-            endpoint="/api/agent/tunnels/apply",
-            data={
-                "tunnel_id": tunnel.id,
-                "core": "frp",
-                "type": transport,
-                "spec": spec
-            }
-        )
-        if response.get("status") == "error":
-            logger.error(f"Failed to create FRP client tunnel {tunnel.id} on Foreign node {foreign_node_id}: {response.get('message')}")
-        else:
-            logger.info(f"Successfully applied FRP client tunnel {tunnel.id} to Foreign node {foreign_node_id}")
-    except Exception as e:
-        logger.error(f"Error creating FRP client tunnel {tunnel.id} on Foreign node {foreign_node_id}: {e}", exc_info=True)
+    return mesh, mesh_configs, nodes_by_id, overlay_ips
 
 
-async def _ensure_backhaul_server(
+async def _fetch_node_status(
     mesh_id: str,
     node_id: str,
-    node: Node,
-    node_config: Dict[str, Any],
-    db: AsyncSession,
-    request: Request,
-    node_client: NodeClient,
-    transport: str = "udp"
-) -> Optional[str]:
-    """Ensure Backhaul server exists on Iran node, return endpoint"""
-    import hashlib
-    
-    if transport not in ["tcp", "udp"]:
-        transport = "udp"
-    
-    tunnel_name = f"wg-mesh-{mesh_id[:8]}-{transport}-{node_id[:8]}"
-    
-    existing_result = await db.execute(
-        select(Tunnel).where(
-            Tunnel.name == tunnel_name,
-            Tunnel.core == "backhaul",
-            Tunnel.type == transport,
-            Tunnel.node_id == node_id
-        )
-    )
-    existing_tunnel = existing_result.scalar_one_or_none()
-    
-    node_ip = node.node_metadata.get("ip_address")
-    if not node_ip:
-        logger.warning(f"Node {node_id} has no IP address")
-        return None
-    
-    if existing_tunnel:
-        # Always delete and recreate Backhaul tunnels to ensure correct port configuration
-        # This prevents issues with old tunnels that may have incorrect endpoints
-        logger.info(f"Deleting existing Backhaul tunnel {existing_tunnel.id} for node {node_id} to ensure correct configuration")
-        try:
-            # Remove from node first
-            await node_client.send_to_node(
-                node_id=node_id,
-                endpoint="/api/agent/tunnels/remove",
-                data={"tunnel_id": existing_tunnel.id}
-            )
-        except Exception as e:
-            logger.warning(f"Error removing old tunnel from node {node_id}: {e}")
-        
-        await db.delete(existing_tunnel)
-        await db.commit()
-        logger.info(f"Deleted old Backhaul tunnel {existing_tunnel.id}, will create new one")
-    
-    port_hash = int(hashlib.md5(f"{mesh_id}-{node_id}-{transport}".encode()).hexdigest()[:8], 16)
-    base_port = 3080 if transport == "udp" else 4080
-    control_port = base_port + (port_hash % 1000)
-    
-    # For WireGuard mesh, Backhaul server only needs to listen on control_port
-    # No port forwarding needed - WireGuard connects directly to control_port
-    spec = {
-        "mode": "server",
-        "transport": transport,
-        "bind_addr": f"0.0.0.0:{control_port}",
-        "control_port": control_port,
-    }
-    
-    logger.info(f"Creating Backhaul server on Iran node: control_port={control_port}, transport={transport}")
-    
-    tunnel = Tunnel(
-        name=tunnel_name,
-        core="backhaul",
-        type=transport,
-        node_id=node_id,
-        spec=spec,
-        status="active"
-    )
-    db.add(tunnel)
-    await db.commit()
-    await db.refresh(tunnel)
-    
+    mesh_configs: Dict[str, Any],
+    nodes_by_id: Dict[str, Any],
+    overlay_ips: Dict[str, str]
+) -> Dict[str, Any]:
+    """Fetch one node's mesh status and decorate it with panel-side details"""
     try:
-        logger.info(f"Applying Backhaul tunnel {tunnel.id} to node {node_id} ({node_ip})")
         response = await node_client.send_to_node(
             node_id=node_id,
-            endpoint="/api/agent/tunnels/apply",
-            data={
-                "tunnel_id": tunnel.id,
-                "core": "backhaul",
-                "type": transport,
-                "spec": spec
-            }
+            endpoint=f"/api/agent/mesh/{mesh_id}/status",
+            method="GET"
         )
-        if response.get("status") == "error":
-            logger.error(f"Failed to create backhaul tunnel {tunnel.id} on node {node_id}: {response.get('message')}")
-            return None
-        logger.info(f"Successfully applied Backhaul tunnel {tunnel.id} to node {node_id}, endpoint: {node_ip}:{control_port}")
-    except Exception as e:
-        logger.error(f"Error creating backhaul tunnel {tunnel.id} on node {node_id}: {e}", exc_info=True)
-        return None
-    
-    # WireGuard should connect to control_port (where Backhaul server listens), not public_port
-    return f"{node_ip}:{control_port}"
-
-
-async def _ensure_backhaul_client(
-    mesh_id: str,
-    foreign_node_id: str,
-    foreign_node: Node,
-    iran_node: Node,
-    iran_endpoint: str,
-    db: AsyncSession,
-    request: Request,
-    node_client: NodeClient,
-    transport: str = "udp"
-) -> None:
-    """Ensure Backhaul client exists on Foreign node connecting to Iran server"""
-    import hashlib
-    
-    if transport not in ["tcp", "udp"]:
-        transport = "udp"
-    
-    tunnel_name = f"wg-mesh-{mesh_id[:8]}-{transport}-{foreign_node_id[:8]}"
-    
-    existing_result = await db.execute(
-        select(Tunnel).where(
-            Tunnel.name == tunnel_name,
-            Tunnel.core == "backhaul",
-            Tunnel.type == transport,
-            Tunnel.node_id == foreign_node_id
-        )
-    )
-    existing_tunnel = existing_result.scalar_one_or_none()
-    
-    if existing_tunnel:
-        logger.info(f"Deleting existing Backhaul client tunnel {existing_tunnel.id} for Foreign node {foreign_node_id}")
-        try:
-            await node_client.send_to_node(
-                node_id=foreign_node_id,
-                endpoint="/api/agent/tunnels/remove",
-                data={"tunnel_id": existing_tunnel.id}
-            )
-        except Exception as e:
-            logger.warning(f"Error removing old tunnel from Foreign node {foreign_node_id}: {e}")
+        node_data = response.get("data", {})
         
-        await db.delete(existing_tunnel)
-        await db.commit()
-        logger.info(f"Deleted old Backhaul client tunnel {existing_tunnel.id}, will create new one")
-    
-    # Parse Iran endpoint to get IP and port
-    if ":" in iran_endpoint:
-        iran_ip, iran_port = iran_endpoint.rsplit(":", 1)
-    else:
-        logger.error(f"Invalid Iran endpoint format: {iran_endpoint}")
-        return
-    
-    spec = {
-        "mode": "client",
-        "transport": transport,
-        "remote_addr": iran_endpoint,
-    }
-    
-    logger.info(f"Creating Backhaul client on Foreign node {foreign_node_id} connecting to Iran {iran_endpoint}")
-    
-    tunnel = Tunnel(
-        name=tunnel_name,
-        core="backhaul",
-        type=transport,
-        node_id=foreign_node_id,
-        spec=spec,
-        status="active"
-    )
-    db.add(tunnel)
-    await db.commit()
-    await db.refresh(tunnel)
-    
-    try:
-        logger.info(f"Applying Backhaul client tunnel {tunnel.id} to Foreign node {foreign_node_id}")
-        response = await node_client.send_to_node(
-            node_id=foreign_node_id,
-            endpoint="/api/agent/tunnels/apply",
-            data={
-                "tunnel_id": tunnel.id,
-                "core": "backhaul",
-                "type": transport,
-                "spec": spec
-            }
-        )
-        if response.get("status") == "error":
-            logger.error(f"Failed to create Backhaul client tunnel {tunnel.id} on Foreign node {foreign_node_id}: {response.get('message')}")
-        else:
-            logger.info(f"Successfully applied Backhaul client tunnel {tunnel.id} to Foreign node {foreign_node_id}")
+        node = nodes_by_id.get(node_id)
+        
+        # Get LAN subnet from mesh config (handle both list and string formats)
+        node_config = mesh_configs.get(node_id, {})
+        if isinstance(node_config, dict):
+            lan_subnet_data = node_config.get("lan_subnet", "")
+            # Handle both list (new format) and string (legacy format)
+            if isinstance(lan_subnet_data, list):
+                # New format: join list with comma for display
+                node_data["lan_subnet"] = ",".join(lan_subnet_data) if lan_subnet_data else ""
+            elif isinstance(lan_subnet_data, str) and lan_subnet_data:
+                # Legacy format: single subnet string
+                node_data["lan_subnet"] = lan_subnet_data
+            node_data["node_name"] = node.name if node else node_id
+        
+        overlay_ip = overlay_ips.get(node_id)
+        if overlay_ip:
+            node_data["overlay_ip"] = overlay_ip
+        
+        return node_data
     except Exception as e:
-        logger.error(f"Error creating Backhaul client tunnel {tunnel.id} on Foreign node {foreign_node_id}: {e}", exc_info=True)
+        logger.error(f"Error getting status from node {node_id}: {e}")
+        return {"error": str(e)}
 
 
 @router.get("/{mesh_id}/status")
@@ -1000,56 +768,14 @@ async def get_mesh_status(
     db: AsyncSession = Depends(get_db)
 ):
     """Get mesh status from all nodes"""
-    result = await db.execute(
-        select(WireGuardMesh).where(WireGuardMesh.id == mesh_id)
-    )
-    mesh = result.scalar_one_or_none()
-    
-    if not mesh:
-        raise HTTPException(status_code=404, detail="Mesh not found")
+    mesh, mesh_configs, nodes_by_id, overlay_ips = await _load_mesh_status_context(db, mesh_id)
     
-    mesh_config_data = mesh.mesh_config or {}
-    mesh_configs = mesh_config_data.get("nodes", {}) if isinstance(mesh_config_data, dict) and "nodes" in mesh_config_data else mesh_config_data
-    
-    node_client = NodeClient()
-    node_statuses = {}
-    
-    for node_id in mesh_configs.keys():
-        try:
-            response = await node_client.send_to_node(
-                node_id=node_id,
-                endpoint=f"/api/agent/mesh/{mesh_id}/status",
-                method="GET"
-            )
-            node_data = response.get("data", {})
-            
-            # Get node info
-            node_result = await db.execute(
-                select(Node).where(Node.id == node_id)
-            )
-            node = node_result.scalar_one_or_none()
-            
-            # Get LAN subnet from mesh config (handle both list and string formats)
-            node_config = mesh_configs.get(node_id, {})
-            if isinstance(node_config, dict):
-                lan_subnet_data = node_config.get("lan_subnet", "")
-                # Handle both list (new format) and string (legacy format)
-                if isinstance(lan_subnet_data, list):
-                    # New format: join list with comma for display
-                    node_data["lan_subnet"] = ",".join(lan_subnet_data) if lan_subnet_data else ""
-                elif isinstance(lan_subnet_data, str) and lan_subnet_data:
-                    # Legacy format: single subnet string
-                    node_data["lan_subnet"] = lan_subnet_data
-                node_data["node_name"] = node.name if node else node_id
-            
-            overlay_ip = await ipam_manager.get_node_ip(db, node_id)
-            if overlay_ip:
-                node_data["overlay_ip"] = overlay_ip
-            
-            node_statuses[node_id] = node_data
-        except Exception as e:
-            logger.error(f"Error getting status from node {node_id}: {e}")
-            node_statuses[node_id] = {"error": str(e)}
+    node_ids = list(mesh_configs.keys())
+    results = await asyncio.gather(*(
+        _fetch_node_status(mesh_id, node_id, mesh_configs, nodes_by_id, overlay_ips)
+        for node_id in node_ids
+    ))
+    node_statuses = dict(zip(node_ids, results))
     
     return {
         "mesh_id": mesh_id,
@@ -1059,6 +785,39 @@ async def get_mesh_status(
     }
 
 
+@router.get("/{mesh_id}/status/stream")
+async def stream_mesh_status(
+    mesh_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream per-node mesh status as Server-Sent Events as each node answers"""
+    mesh, mesh_configs, nodes_by_id, overlay_ips = await _load_mesh_status_context(db, mesh_id)
+    
+    async def status_for_node(node_id: str):
+        data = await _fetch_node_status(mesh_id, node_id, mesh_configs, nodes_by_id, overlay_ips)
+        return node_id, data
+    
+    async def event_stream():
+        yield f"event: mesh\ndata: {orjson.dumps({'mesh_id': mesh_id, 'mesh_name': mesh.name, 'status': mesh.status}).decode()}\n\n"
+        tasks = [asyncio.create_task(status_for_node(node_id)) for node_id in mesh_configs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                node_id, node_data = await next_done
+                yield f"data: {orjson.dumps({'node_id': node_id, 'data': node_data}).decode()}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        finally:
+            # Client disconnected mid-stream: stop waiting on the remaining nodes
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.post("/{mesh_id}/rotate-keys")
 async def rotate_mesh_keys(
     mesh_id: str,
@@ -1066,38 +825,37 @@ async def rotate_mesh_keys(
     db: AsyncSession = Depends(get_db)
 ):
     """Rotate WireGuard keys for mesh"""
-    result = await db.execute(
-        select(WireGuardMesh).where(WireGuardMesh.id == mesh_id)
-    )
-    mesh = result.scalar_one_or_none()
+    mesh = await db.get(WireGuardMesh, mesh_id)
     
     if not mesh:
         raise HTTPException(status_code=404, detail="Mesh not found")
     
     old_config_data = mesh.mesh_config or {}
-    old_transport = old_config_data.get("transport", "udp") if isinstance(old_config_data, dict) else "udp"
-    old_configs = old_config_data.get("nodes", old_config_data) if isinstance(old_config_data, dict) and "nodes" in old_config_data else old_config_data
+    old_transport = old_config_data.get("transport", "udp")
+    old_configs = _nodes_of(old_config_data)
+    
+    # Names and overlay IPs are already in the stored configs, only check the nodes still exist
+    ids_result = await db.execute(_NODE_IDS_STMT, {"ids": list(old_configs.keys())})
+    existing_node_ids = set(ids_result.scalars().all())
     
     node_configs = []
     for node_id, node_config in old_configs.items():
         if not isinstance(node_config, dict):
             continue
         
-        node_result = await db.execute(
-            select(Node).where(Node.id == node_id)
-        )
-        node = node_result.scalar_one_or_none()
-        if not node:
+        if node_id not in existing_node_ids:
             continue
         
-        node_configs.append({
-            "node_id": node_id,
-            "name": node.name,
-            "lan_subnet": node_config.get("lan_subnet", "")
-        })
+        node_configs.append(MeshNode(
+            node_id=node_id,
+            name=node_config.get("node_name") or node_id,
+            lan_subnet=node_config.get("lan_subnet", ""),
+            overlay_ip=node_config.get("overlay_ip")
+        ))
     
     try:
-        new_configs = wireguard_mesh_manager.create_mesh_config(
+        new_configs = await asyncio.to_thread(
+            wireguard_mesh_manager.create_mesh_config,
             mesh_id=mesh_id,
             nodes=node_configs,
             overlay_subnet=mesh.overlay_subnet,
@@ -1106,6 +864,7 @@ async def rotate_mesh_keys(
         )
         mesh_config_data = {
             "transport": old_transport,
+            "wireguard_port": old_config_data.get("wireguard_port"),
             "nodes": new_configs
         }
         mesh.mesh_config = mesh_config_data
@@ -1118,9 +877,22 @@ async def rotate_mesh_keys(
 
 
 @router.get("", response_model=List[MeshResponse])
-async def list_meshes(db: AsyncSession = Depends(get_db)):
-    """List all meshes"""
-    result = await db.execute(select(WireGuardMesh))
+async def list_meshes(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """List all meshes
+    
+    With limit set, meshes are returned in id order one page at a time; pass the
+    last id of a page as after to fetch the next one.
+    """
+    stmt = select(WireGuardMesh)
+    if limit is not None:
+        stmt = stmt.order_by(WireGuardMesh.id).limit(limit)
+        if after:
+            stmt = stmt.where(WireGuardMesh.id > after)
+    result = await db.execute(stmt)
     meshes = result.scalars().all()
     return meshes
 
@@ -1132,19 +904,14 @@ async def delete_mesh(
     db: AsyncSession = Depends(get_db)
 ):
     """Delete mesh and cleanup"""
-    result = await db.execute(
-        select(WireGuardMesh).where(WireGuardMesh.id == mesh_id)
-    )
-    mesh = result.scalar_one_or_none()
+    mesh = await db.get(WireGuardMesh, mesh_id)
     
     if not mesh:
         raise HTTPException(status_code=404, detail="Mesh not found")
     
-    mesh_config_data = mesh.mesh_config or {}
-    mesh_configs = mesh_config_data.get("nodes", {}) if isinstance(mesh_config_data, dict) and "nodes" in mesh_config_data else mesh_config_data
-    node_client = NodeClient()
+    mesh_configs = _nodes_of(mesh.mesh_config)
     
-    for node_id in mesh_configs.keys():
+    async def remove_from_node(node_id: str):
         try:
             await node_client.send_to_node(
                 node_id=node_id,
@@ -1154,16 +921,11 @@ async def delete_mesh(
         except Exception as e:
             logger.warning(f"Error removing mesh from node {node_id}: {e}")
     
-    tunnel_result = await db.execute(
-        select(Tunnel).where(
-            (Tunnel.name.like(f"wg-mesh-{mesh_id[:8]}%")) |
-            (Tunnel.name.like(f"wg-mesh-{mesh_id[:8]}-tcp-%")) |
-            (Tunnel.name.like(f"wg-mesh-{mesh_id[:8]}-udp-%"))
-        )
+    await asyncio.gather(*(remove_from_node(node_id) for node_id in mesh_configs.keys()))
+    
+    await db.execute(
+        delete(Tunnel).where(Tunnel.mesh_id == mesh_id)
     )
-    tunnels = tunnel_result.scalars().all()
-    for tunnel in tunnels:
-        await db.delete(tunnel)
     
     await db.delete(mesh)
     await db.commit()
@@ -1,19 +1,67 @@
 """Nodes API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List
+from sqlalchemy import select, update, func
+from sqlalchemy.orm.attributes import flag_modified
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from pydantic import BaseModel
-import httpx
+import asyncio
+import hashlib
+import time
 
 from app.database import get_db
 from app.models import Node
-from app.node_client import NodeClient
+from app.node_client import classify_connection, node_client
+from app.ipam_manager import ipam_manager
 
 
 router = APIRouter()
 
+NODE_PROBE_TIMEOUT = 5.0  # Seconds before a silent node is reported as reconnecting
+
+# The dashboard polls GET /nodes every few seconds; reuse recent probe results
+# instead of contacting every node on every poll
+CONNECTION_STATUS_CACHE_TTL = 5.0
+_connection_status_cache: Dict[str, Tuple[float, str]] = {}
+
+
+async def _get_connection_status(node_id: str) -> str:
+    """Get a node's connection state, cached for CONNECTION_STATUS_CACHE_TTL seconds"""
+    now = time.monotonic()
+    cached = _connection_status_cache.get(node_id)
+    if cached and now - cached[0] < CONNECTION_STATUS_CACHE_TTL:
+        return cached[1]
+    
+    connection_status = await _probe_connection_status(node_id)
+    _connection_status_cache[node_id] = (now, connection_status)
+    return connection_status
+
+
+async def _probe_connection_status(node_id: str) -> str:
+    """Classify a node's connection state from its agent status endpoint"""
+    try:
+        response = await asyncio.wait_for(node_client.get_tunnel_status(node_id, ""), timeout=NODE_PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return "reconnecting"
+    except Exception as e:
+        return classify_connection(None, e)[0]
+    return classify_connection(response)[0]
+
+
+async def backfill_node_columns(db: AsyncSession) -> int:
+    """Copy role and ip_address out of node metadata for nodes registered before those columns existed"""
+    result = await db.execute(
+        update(Node)
+        .where(Node.role.is_(None))
+        .values(
+            role=func.coalesce(Node.node_metadata["role"].as_string(), "iran"),
+            ip_address=Node.node_metadata["ip_address"].as_string()
+        )
+    )
+    await db.commit()
+    return result.rowcount or 0
+
 
 class NodeCreate(BaseModel):
     name: str
@@ -39,8 +87,6 @@ class NodeResponse(BaseModel):
 @router.post("", response_model=NodeResponse)
 async def create_node(node: NodeCreate, db: AsyncSession = Depends(get_db)):
     """Register a new node"""
-    import hashlib
-    
     fingerprint_data = f"{node.ip_address}:{node.api_port}".encode()
     fingerprint = hashlib.sha256(fingerprint_data).hexdigest()[:16]
     
@@ -74,6 +120,9 @@ async def create_node(node: NodeCreate, db: AsyncSession = Depends(get_db)):
         existing.status = "active"
         existing.node_metadata.update(metadata)
         existing.node_metadata["role"] = existing_role
+        flag_modified(existing, "node_metadata")
+        existing.role = existing_role
+        existing.ip_address = node.ip_address
         await db.commit()
         await db.refresh(existing)
         return NodeResponse(
@@ -90,17 +139,19 @@ async def create_node(node: NodeCreate, db: AsyncSession = Depends(get_db)):
         name=node.name,
         fingerprint=fingerprint,
         status="active",
+        role=incoming_role,
+        ip_address=node.ip_address,
         node_metadata=metadata
     )
     db.add(db_node)
     await db.commit()
     await db.refresh(db_node)
     
-    from app.ipam_manager import ipam_manager
     overlay_ip = await ipam_manager.allocate_ip(db, db_node.id)
     if overlay_ip:
         metadata["overlay_ip"] = overlay_ip
         db_node.node_metadata = metadata
+        flag_modified(db_node, "node_metadata")
         await db.commit()
         await db.refresh(db_node)
     
@@ -116,33 +167,29 @@ async def create_node(node: NodeCreate, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("", response_model=List[NodeResponse])
-async def list_nodes(db: AsyncSession = Depends(get_db)):
-    """List all nodes with connection state"""
-    result = await db.execute(select(Node))
+async def list_nodes(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """List all nodes with connection state
+    
+    With limit set, nodes are returned in id order one page at a time; pass the
+    last id of a page as after to fetch the next one. Only that page is probed.
+    """
+    stmt = select(Node)
+    if limit is not None:
+        stmt = stmt.order_by(Node.id).limit(limit)
+        if after:
+            stmt = stmt.where(Node.id > after)
+    result = await db.execute(stmt)
     nodes = result.scalars().all()
     
-    client = NodeClient()
+    # Probe every node at once so one slow node does not delay the rest
+    statuses = await asyncio.gather(*(_get_connection_status(node.id) for node in nodes))
     node_responses = []
     
-    for node in nodes:
-        connection_status = "failed"
-        try:
-            response = await client.get_tunnel_status(node.id, "")
-            if response and response.get("status") == "ok":
-                connection_status = "connected"
-            else:
-                error_msg = response.get("message", "Node disconnected") if response else "Node not responding"
-                if "timeout" in error_msg.lower() or "connection" in error_msg.lower():
-                    connection_status = "reconnecting"
-                else:
-                    connection_status = "failed"
-        except httpx.ConnectError:
-            connection_status = "connecting"
-        except httpx.TimeoutException:
-            connection_status = "reconnecting"
-        except Exception:
-            connection_status = "failed"
-        
+    for node, connection_status in zip(nodes, statuses):
         metadata = node.node_metadata.copy() if node.node_metadata else {}
         metadata["connection_status"] = connection_status
         
@@ -162,8 +209,7 @@ async def list_nodes(db: AsyncSession = Depends(get_db)):
 @router.get("/{node_id}", response_model=NodeResponse)
 async def get_node(node_id: str, db: AsyncSession = Depends(get_db)):
     """Get node by ID"""
-    result = await db.execute(select(Node).where(Node.id == node_id))
-    node = result.scalar_one_or_none()
+    node = await db.get(Node, node_id)
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
     return NodeResponse(
@@ -180,12 +226,12 @@ async def get_node(node_id: str, db: AsyncSession = Depends(get_db)):
 @router.delete("/{node_id}")
 async def delete_node(node_id: str, db: AsyncSession = Depends(get_db)):
     """Delete a node"""
-    result = await db.execute(select(Node).where(Node.id == node_id))
-    node = result.scalar_one_or_none()
+    node = await db.get(Node, node_id)
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
     
     await db.delete(node)
     await db.commit()
+    _connection_status_cache.pop(node_id, None)
     return {"status": "deleted"}
 
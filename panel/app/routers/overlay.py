@@ -2,6 +2,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm.attributes import flag_modified
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import logging
@@ -10,7 +11,7 @@ from datetime import datetime
 from app.database import get_db
 from app.models import OverlayPool, OverlayAssignment, Node
 from app.ipam_manager import ipam_manager
-from app.node_client import NodeClient
+from app.node_client import node_client
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -93,16 +94,22 @@ async def delete_pool(db: AsyncSession = Depends(get_db)):
     assignments_result = await db.execute(select(OverlayAssignment))
     assignments = assignments_result.scalars().all()
     
+    nodes_result = await db.execute(
+        select(Node).where(Node.id.in_([assignment.node_id for assignment in assignments]))
+    )
+    nodes_by_id = {node.id: node for node in nodes_result.scalars().all()}
+    
     for assignment in assignments:
-        node_result = await db.execute(select(Node).where(Node.id == assignment.node_id))
-        node = node_result.scalar_one_or_none()
+        node = nodes_by_id.get(assignment.node_id)
         if node and node.node_metadata:
             node.node_metadata.pop("overlay_ip", None)
+            flag_modified(node, "node_metadata")
             await db.commit()
         await db.delete(assignment)
     
     await db.delete(pool)
     await db.commit()
+    ipam_manager.invalidate_pool_cache()
     
     return {"status": "success", "message": "Pool and all assignments deleted"}
 
@@ -114,8 +121,7 @@ async def assign_ip(
     db: AsyncSession = Depends(get_db)
 ):
     """Assign overlay IP to a node"""
-    node_result = await db.execute(select(Node).where(Node.id == node_id))
-    node = node_result.scalar_one_or_none()
+    node = await db.get(Node, node_id)
     
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
@@ -130,13 +136,12 @@ async def assign_ip(
     if not allocated_ip:
         raise HTTPException(status_code=500, detail="Failed to allocate IP. Pool may be exhausted.")
     
-    node_result = await db.execute(select(Node).where(Node.id == node_id))
-    node = node_result.scalar_one_or_none()
+    node = await db.get(Node, node_id)
     if node and node.node_metadata:
         node.node_metadata["overlay_ip"] = allocated_ip
+        flag_modified(node, "node_metadata")
         await db.commit()
     
-    node_client = NodeClient()
     try:
         response = await node_client.send_to_node(
             node_id=node_id,
@@ -169,8 +174,7 @@ async def update_assignment(
     if not request.preferred_ip:
         raise HTTPException(status_code=400, detail="preferred_ip is required for update")
     
-    node_result = await db.execute(select(Node).where(Node.id == node_id))
-    node = node_result.scalar_one_or_none()
+    node = await db.get(Node, node_id)
     
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
@@ -185,7 +189,6 @@ async def update_assignment(
     if not success:
         raise HTTPException(status_code=400, detail="Failed to update IP. Check if IP is valid and available.")
     
-    node_client = NodeClient()
     try:
         response = await node_client.send_to_node(
             node_id=node_id,
@@ -219,7 +222,6 @@ async def release_ip(
     if not success:
         raise HTTPException(status_code=404, detail="No overlay IP assigned to this node")
     
-    node_client = NodeClient()
     try:
         await node_client.send_to_node(
             node_id=node_id,
@@ -297,6 +299,7 @@ async def sync_node_ips(db: AsyncSession = Depends(get_db)):
                 if not node.node_metadata:
                     node.node_metadata = {}
                 node.node_metadata["overlay_ip"] = assignment.overlay_ip
+                flag_modified(node, "node_metadata")
                 await db.commit()
                 synced += 1
                 logger.info(f"Synced overlay IP {assignment.overlay_ip} to node {node.id} metadata")
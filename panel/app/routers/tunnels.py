@@ -2,15 +2,18 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm.attributes import flag_modified
 from typing import List
 from datetime import datetime
 from pydantic import BaseModel
 import logging
+import os
 import time
 
 from app.database import get_db
 from app.models import Tunnel, Node
-from app.node_client import NodeClient
+from app.node_client import node_client
+from app.utils import is_valid_ipv6_address, default_frp_bind_port
 
 
 router = APIRouter()
@@ -53,7 +56,6 @@ def prepare_frp_spec_for_node(spec: dict, node: Node, request: Request) -> dict:
             panel_host = request_host
     
     if not panel_host or panel_host in ["localhost", "127.0.0.1", "::1", "0.0.0.0"]:
-        import os
         panel_public_ip = os.getenv("PANEL_PUBLIC_IP") or os.getenv("PANEL_IP")
         if panel_public_ip and panel_public_ip not in ["localhost", "127.0.0.1", "::1", "0.0.0.0", ""]:
             panel_host = panel_public_ip
@@ -73,7 +75,6 @@ def prepare_frp_spec_for_node(spec: dict, node: Node, request: Request) -> dict:
         logger.error(error_msg)
         raise ValueError(error_msg)
     
-    from app.utils import is_valid_ipv6_address
     if is_valid_ipv6_address(panel_host):
         server_addr = f"[{panel_host}]"
     else:
@@ -125,8 +126,6 @@ class TunnelResponse(BaseModel):
 @router.post("", response_model=TunnelResponse)
 async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession = Depends(get_db)):
     """Create a new tunnel and auto-apply it"""
-    from app.node_client import NodeClient
-    
     logger.info(f"Creating tunnel: name={tunnel.name}, type={tunnel.type}, core={tunnel.core}, node_id={tunnel.node_id}")
     
     is_reverse_tunnel = tunnel.core == "frp"
@@ -136,47 +135,38 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
     if is_reverse_tunnel:
         foreign_node_id_val = tunnel.foreign_node_id if tunnel.foreign_node_id and (not isinstance(tunnel.foreign_node_id, str) or tunnel.foreign_node_id.strip()) else None
         if foreign_node_id_val:
-            result = await db.execute(select(Node).where(Node.id == foreign_node_id_val))
-            foreign_node = result.scalar_one_or_none()
+            foreign_node = await db.get(Node, foreign_node_id_val)
             if not foreign_node:
                 raise HTTPException(status_code=404, detail=f"Foreign node {foreign_node_id_val} not found")
-            if foreign_node.node_metadata.get("role") != "foreign":
+            if foreign_node.role != "foreign":
                 raise HTTPException(status_code=400, detail=f"Node {foreign_node_id_val} is not a foreign node")
         
         iran_node_id_val = tunnel.iran_node_id if tunnel.iran_node_id and (not isinstance(tunnel.iran_node_id, str) or tunnel.iran_node_id.strip()) else None
         if iran_node_id_val:
-            result = await db.execute(select(Node).where(Node.id == iran_node_id_val))
-            iran_node = result.scalar_one_or_none()
+            iran_node = await db.get(Node, iran_node_id_val)
             if not iran_node:
                 raise HTTPException(status_code=404, detail=f"Iran node {iran_node_id_val} not found")
-            if iran_node.node_metadata.get("role") != "iran":
+            if iran_node.role != "iran":
                 raise HTTPException(status_code=400, detail=f"Node {iran_node_id_val} is not an iran node")
         
         node_id_val = tunnel.node_id if tunnel.node_id and (not isinstance(tunnel.node_id, str) or tunnel.node_id.strip()) else None
         if node_id_val and not (foreign_node and iran_node):
-            result = await db.execute(select(Node).where(Node.id == node_id_val))
-            provided_node = result.scalar_one_or_none()
+            provided_node = await db.get(Node, node_id_val)
             if not provided_node:
                 raise HTTPException(status_code=404, detail="Node not found")
             
-            node_role = provided_node.node_metadata.get("role", "iran")
+            node_role = provided_node.role or "iran"
             if node_role == "foreign":
                 foreign_node = provided_node
-                result = await db.execute(select(Node))
-                all_nodes = result.scalars().all()
-                iran_nodes = [n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "iran"]
-                if iran_nodes:
-                    iran_node = iran_nodes[0]
-                else:
+                result = await db.execute(select(Node).where(Node.role == "iran").limit(1))
+                iran_node = result.scalars().first()
+                if not iran_node:
                     raise HTTPException(status_code=400, detail="No iran node found. Please specify iran_node_id or register an iran node.")
             else:
                 iran_node = provided_node
-                result = await db.execute(select(Node))
-                all_nodes = result.scalars().all()
-                foreign_nodes = [n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "foreign"]
-                if foreign_nodes:
-                    foreign_node = foreign_nodes[0]
-                else:
+                result = await db.execute(select(Node).where(Node.role == "foreign").limit(1))
+                foreign_node = result.scalars().first()
+                if not foreign_node:
                     raise HTTPException(status_code=400, detail="No foreign node found. Please specify foreign_node_id or register a foreign node.")
         
         if not foreign_node or not iran_node:
@@ -187,8 +177,7 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
         node = None
         if tunnel.node_id or tunnel.iran_node_id:
             node_id_to_check = tunnel.iran_node_id or tunnel.node_id
-            result = await db.execute(select(Node).where(Node.id == node_id_to_check))
-            node = result.scalar_one_or_none()
+            node = await db.get(Node, node_id_to_check)
     
     tunnel_node_id = tunnel.iran_node_id or tunnel.node_id or ""
     
@@ -201,8 +190,8 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
         status="pending"
     )
     db.add(db_tunnel)
+    # id and timestamps come from Python-side defaults on flush, no refresh needed
     await db.commit()
-    await db.refresh(db_tunnel)
     
     try:
         needs_frp_server = db_tunnel.core == "frp"
@@ -215,7 +204,7 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
         )
         
         if is_reverse_tunnel and foreign_node and iran_node:
-            client = NodeClient()
+            client = node_client
             
             server_spec = db_tunnel.spec.copy() if db_tunnel.spec else {}
             server_spec["mode"] = "server"
@@ -224,15 +213,13 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             client_spec["mode"] = "client"
             
             if db_tunnel.core == "frp":
-                import hashlib
-                port_hash = int(hashlib.md5(db_tunnel.id.encode()).hexdigest()[:8], 16)
-                bind_port = server_spec.get("bind_port") or (7000 + (port_hash % 1000))
+                bind_port = server_spec.get("bind_port") or default_frp_bind_port(db_tunnel.id)
                 token = server_spec.get("token")
                 server_spec["bind_port"] = bind_port
                 if token:
                     server_spec["token"] = token
                 
-                iran_node_ip = iran_node.node_metadata.get("ip_address")
+                iran_node_ip = iran_node.ip_address
                 if not iran_node_ip:
                     db_tunnel.status = "error"
                     db_tunnel.error_message = "Iran node has no IP address"
@@ -260,6 +247,7 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             
             if not iran_node.node_metadata.get("api_address"):
                 iran_node.node_metadata["api_address"] = f"http://{iran_node.node_metadata.get('ip_address', iran_node.fingerprint)}:{iran_node.node_metadata.get('api_port', 8888)}"
+                flag_modified(iran_node, "node_metadata")
                 await db.commit()
             
             logger.info(f"Applying server config to iran node {iran_node.id} for tunnel {db_tunnel.id}")
@@ -285,6 +273,7 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             
             if not foreign_node.node_metadata.get("api_address"):
                 foreign_node.node_metadata["api_address"] = f"http://{foreign_node.node_metadata.get('ip_address', foreign_node.fingerprint)}:{foreign_node.node_metadata.get('api_port', 8888)}"
+                flag_modified(foreign_node, "node_metadata")
                 await db.commit()
             
             logger.info(f"Applying client config to foreign node {foreign_node.id} for tunnel {db_tunnel.id}")
@@ -338,7 +327,6 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             token = db_tunnel.spec.get("token")
             
             if bind_port:
-                from app.utils import parse_address_port
                 try:
                     if int(bind_port) == 8000:
                         db_tunnel.status = "error"
@@ -388,9 +376,10 @@ async def create_tunnel(tunnel: TunnelCreate, request: Request, db: AsyncSession
             if not node:
                 raise HTTPException(status_code=400, detail=f"Node is required for {db_tunnel.core.title()} tunnels")
             
-            client = NodeClient()
+            client = node_client
             if not node.node_metadata.get("api_address"):
                 node.node_metadata["api_address"] = f"http://{node.node_metadata.get('ip_address', node.fingerprint)}:{node.node_metadata.get('api_port', 8888)}"
+                flag_modified(node, "node_metadata")
                 await db.commit()
             
             spec_for_node = db_tunnel.spec.copy() if db_tunnel.spec else {}
@@ -487,8 +476,7 @@ async def list_tunnels(db: AsyncSession = Depends(get_db)):
 @router.get("/{tunnel_id}", response_model=TunnelResponse)
 async def get_tunnel(tunnel_id: str, db: AsyncSession = Depends(get_db)):
     """Get tunnel by ID"""
-    result = await db.execute(select(Tunnel).where(Tunnel.id == tunnel_id))
-    tunnel = result.scalar_one_or_none()
+    tunnel = await db.get(Tunnel, tunnel_id)
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
     return tunnel
@@ -502,10 +490,7 @@ async def update_tunnel(
     db: AsyncSession = Depends(get_db)
 ):
     """Update a tunnel and re-apply if spec changed"""
-    from app.node_client import NodeClient
-    
-    result = await db.execute(select(Tunnel).where(Tunnel.id == tunnel_id))
-    tunnel = result.scalar_one_or_none()
+    tunnel = await db.get(Tunnel, tunnel_id)
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
     
@@ -551,10 +536,9 @@ async def update_tunnel(
                             tunnel.error_message = f"FRP server error: {str(e)}"
             
             if needs_node_apply and tunnel.node_id:
-                result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-                node = result.scalar_one_or_none()
+                node = await db.get(Node, tunnel.node_id)
                 if node:
-                    client = NodeClient()
+                    client = node_client
                     try:
                         spec_for_node = tunnel.spec.copy() if tunnel.spec else {}
                         frp_prep_failed = False
@@ -609,20 +593,19 @@ async def update_tunnel(
 @router.post("/{tunnel_id}/apply")
 async def apply_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Depends(get_db)):
     """Apply tunnel configuration to node"""
-    result = await db.execute(select(Tunnel).where(Tunnel.id == tunnel_id))
-    tunnel = result.scalar_one_or_none()
+    tunnel = await db.get(Tunnel, tunnel_id)
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
     
-    result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-    node = result.scalar_one_or_none()
+    node = await db.get(Node, tunnel.node_id)
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
     
-    client = NodeClient()
+    client = node_client
     try:
         if not node.node_metadata.get("api_address"):
             node.node_metadata["api_address"] = f"http://{node.fingerprint}:8888"
+            flag_modified(node, "node_metadata")
             await db.commit()
         
         spec_for_node = tunnel.spec.copy() if tunnel.spec else {}
@@ -669,8 +652,7 @@ async def apply_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Depe
 @router.delete("/{tunnel_id}")
 async def delete_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Depends(get_db)):
     """Delete a tunnel"""
-    result = await db.execute(select(Tunnel).where(Tunnel.id == tunnel_id))
-    tunnel = result.scalar_one_or_none()
+    tunnel = await db.get(Tunnel, tunnel_id)
     if not tunnel:
         raise HTTPException(status_code=404, detail="Tunnel not found")
     
@@ -685,7 +667,6 @@ async def delete_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Dep
             try:
                 request.app.state.gost_forwarder.stop_forward(tunnel.id)
             except Exception as e:
-                import logging
                 logging.error(f"Failed to stop gost forwarding: {e}")
     
     elif needs_rathole_server:
@@ -693,28 +674,24 @@ async def delete_tunnel(tunnel_id: str, request: Request, db: AsyncSession = Dep
             try:
                 request.app.state.rathole_server_manager.stop_server(tunnel.id)
             except Exception as e:
-                import logging
                 logging.error(f"Failed to stop Rathole server: {e}")
     elif needs_backhaul_server:
         if hasattr(request.app.state, "backhaul_manager"):
             try:
                 request.app.state.backhaul_manager.stop_server(tunnel.id)
             except Exception as e:
-                import logging
                 logging.error(f"Failed to stop Backhaul server: {e}")
     if needs_frp_server:
         if hasattr(request.app.state, 'frp_server_manager'):
             try:
                 request.app.state.frp_server_manager.stop_server(tunnel.id)
             except Exception as e:
-                import logging
                 logging.error(f"Failed to stop FRP server: {e}")
     
     if tunnel.status == "active":
-        result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-        node = result.scalar_one_or_none()
+        node = await db.get(Node, tunnel.node_id)
         if node:
-            client = NodeClient()
+            client = node_client
             try:
                 await client.send_to_node(
                     node_id=node.id,
@@ -1,4 +1,5 @@
 """Utility functions for address parsing and validation"""
+import hashlib
 import ipaddress
 import re
 from typing import Tuple, Optional
@@ -115,3 +116,20 @@ def is_valid_ipv6_address(address: str) -> bool:
     except (ValueError, ipaddress.AddressValueError):
         return False
 
+
+
+def default_frp_bind_port(tunnel_id: str) -> int:
+    """
+    Derive the default FRP bind_port for a tunnel that does not set one.
+    
+    Uses the first 32 bits of the MD5 digest of the tunnel id, read directly
+    from the digest bytes, so existing tunnels keep the port they were given.
+    
+    Args:
+        tunnel_id: Tunnel identifier
+        
+    Returns:
+        Port in the 7000-7999 range
+    """
+    port_hash = int.from_bytes(hashlib.md5(tunnel_id.encode()).digest()[:4], "big")
+    return 7000 + (port_hash % 1000)
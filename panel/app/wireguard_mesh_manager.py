@@ -1,65 +1,56 @@
 """WireGuard Mesh Manager - Handles mesh creation, key generation, and configuration"""
+import base64
 import logging
-import subprocess
 import ipaddress
-from typing import Dict, List, Any, Optional, Tuple
-from pathlib import Path
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple, Union
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
 
 logger = logging.getLogger(__name__)
 
 
+class MeshNode(NamedTuple):
+    """Per-node input to WireGuardMeshManager.create_mesh_config"""
+    node_id: str
+    name: str
+    lan_subnet: Union[str, List[str]]
+    overlay_ip: Optional[str]
+
+
+def _normalize_lan_subnets(lan_subnet_data: Any) -> List[str]:
+    """Return LAN subnets as a list, accepting the legacy single-string format"""
+    if isinstance(lan_subnet_data, str):
+        # Legacy format: single subnet string (empty string means no subnets)
+        return [lan_subnet_data] if lan_subnet_data else []
+    return lan_subnet_data if isinstance(lan_subnet_data, list) else []
+
+
 class WireGuardMeshManager:
     """Manages WireGuard mesh networks over Smite Backhaul"""
     
-    def __init__(self):
-        self._wg_binary = None
-    
-    def _resolve_wg_binary(self) -> Path:
-        """Resolve WireGuard binary path (lazy loading)"""
-        if self._wg_binary is not None:
-            return self._wg_binary
-        
-        import shutil
-        wg_path = shutil.which("wg")
-        if wg_path:
-            self._wg_binary = Path(wg_path)
-            return self._wg_binary
-        for path in [Path("/usr/bin/wg"), Path("/usr/local/bin/wg")]:
-            if path.exists():
-                self._wg_binary = path
-                return self._wg_binary
-        raise FileNotFoundError("WireGuard 'wg' binary not found. Install wireguard-tools package.")
-    
     def generate_keypair(self) -> Tuple[str, str]:
-        """Generate WireGuard private/public key pair"""
-        wg_binary = self._resolve_wg_binary()
-        try:
-            private_key_proc = subprocess.run(
-                [str(wg_binary), "genkey"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            private_key = private_key_proc.stdout.strip()
-            
-            public_key_proc = subprocess.run(
-                [str(wg_binary), "pubkey"],
-                input=private_key,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            public_key = public_key_proc.stdout.strip()
-            
-            return private_key, public_key
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to generate WireGuard keypair: {e}")
-            raise RuntimeError(f"WireGuard key generation failed: {e.stderr}")
+        """Generate WireGuard private/public key pair
+        
+        WireGuard keys are base64-encoded raw Curve25519 keys, the same format
+        `wg genkey | wg pubkey` prints, so they are generated in-process with
+        OpenSSL instead of spawning two `wg` processes per node.
+        """
+        private_key = X25519PrivateKey.generate()
+        private_bytes = private_key.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        public_bytes = private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return base64.b64encode(private_bytes).decode(), base64.b64encode(public_bytes).decode()
     
     def create_mesh_config(
         self,
         mesh_id: str,
-        nodes: List[Dict[str, Any]],
+        nodes: List[MeshNode],
         overlay_subnet: str,
         topology: str = "full-mesh",
         mtu: int = 1280
@@ -69,7 +60,7 @@ class WireGuardMeshManager:
         
         Args:
             mesh_id: Unique mesh identifier
-            nodes: List of node dicts with 'node_id', 'name', 'lan_subnet', 'overlay_ip'
+            nodes: MeshNode records with node_id, name, lan_subnet and overlay_ip
             overlay_subnet: WireGuard overlay subnet (e.g., "10.250.0.0/24")
             topology: "full-mesh" or "hub-spoke"
             mtu: MTU for WireGuard interface
@@ -82,19 +73,20 @@ class WireGuardMeshManager:
         except ValueError as e:
             raise ValueError(f"Invalid overlay subnet: {overlay_subnet}")
         
-        node_configs = {}
+        # One pass per node for keys, IP validation and LAN subnet normalization;
+        # the peer loops below only read these precomputed values
         node_keys = {}
-        node_ips = {}
+        node_lan_subnets = {}
         
         for node in nodes:
-            node_id = node["node_id"]
+            node_id = node.node_id
             private_key, public_key = self.generate_keypair()
             node_keys[node_id] = {
                 "private_key": private_key,
                 "public_key": public_key
             }
             
-            overlay_ip = node.get("overlay_ip")
+            overlay_ip = node.overlay_ip
             if not overlay_ip:
                 raise ValueError(f"Node {node_id} missing overlay_ip from IPAM")
             
@@ -105,94 +97,41 @@ class WireGuardMeshManager:
             except ValueError as e:
                 raise ValueError(f"Invalid overlay IP for node {node_id}: {e}")
             
-            node_ips[node_id] = overlay_ip
+            node_lan_subnets[node_id] = _normalize_lan_subnets(node.lan_subnet)
+        
+        def peer_entry(peer: MeshNode) -> Dict[str, Any]:
+            return {
+                "node_id": peer.node_id,
+                "public_key": node_keys[peer.node_id]["public_key"],
+                "overlay_ip": peer.overlay_ip,
+                "lan_subnet": node_lan_subnets[peer.node_id]
+            }
         
-        mesh_config = {
-            "mesh_id": mesh_id,
-            "overlay_subnet": overlay_subnet,
-            "topology": topology,
-            "mtu": mtu,
-            "nodes": {}
-        }
+        node_configs = {}
+        hub_node = nodes[0] if nodes else None
         
         for node in nodes:
-            node_id = node["node_id"]
-            node_name = node.get("name", node_id)
-            # Handle both old format (string) and new format (list) for backward compatibility
-            lan_subnet_data = node.get("lan_subnet", "")
-            if isinstance(lan_subnet_data, str):
-                # Legacy format: single subnet string (empty string means no subnets)
-                lan_subnets_list = [lan_subnet_data] if lan_subnet_data else []
-            else:
-                # New format: list of subnets
-                lan_subnets_list = lan_subnet_data if isinstance(lan_subnet_data, list) else []
+            node_id = node.node_id
             
             peers = []
             if topology == "full-mesh":
-                for peer_node in nodes:
-                    if peer_node["node_id"] == node_id:
-                        continue
-                    peer_id = peer_node["node_id"]
-                    peer_lan_subnet_data = peer_node.get("lan_subnet", "")
-                    # Handle both old and new formats
-                    if isinstance(peer_lan_subnet_data, str):
-                        peer_lan_subnets_list = [peer_lan_subnet_data] if peer_lan_subnet_data else []
-                    else:
-                        peer_lan_subnets_list = peer_lan_subnet_data if isinstance(peer_lan_subnet_data, list) else []
-                    
-                    peer_config = {
-                        "node_id": peer_id,
-                        "public_key": node_keys[peer_id]["public_key"],
-                        "overlay_ip": node_ips[peer_id],
-                        "lan_subnet": peer_lan_subnets_list
-                    }
-                    peers.append(peer_config)
+                peers = [peer_entry(peer) for peer in nodes if peer.node_id != node_id]
             elif topology == "hub-spoke":
-                hub_node_id = nodes[0]["node_id"]
-                if node_id == hub_node_id:
-                    for peer_node in nodes[1:]:
-                        peer_id = peer_node["node_id"]
-                        peer_lan_subnet_data = peer_node.get("lan_subnet", "")
-                        # Handle both old and new formats
-                        if isinstance(peer_lan_subnet_data, str):
-                            peer_lan_subnets_list = [peer_lan_subnet_data] if peer_lan_subnet_data else []
-                        else:
-                            peer_lan_subnets_list = peer_lan_subnet_data if isinstance(peer_lan_subnet_data, list) else []
-                        peer_config = {
-                            "node_id": peer_id,
-                            "public_key": node_keys[peer_id]["public_key"],
-                            "overlay_ip": node_ips[peer_id],
-                            "lan_subnet": peer_lan_subnets_list
-                        }
-                        peers.append(peer_config)
+                if node_id == hub_node.node_id:
+                    peers = [peer_entry(peer) for peer in nodes[1:]]
                 else:
-                    hub_lan_subnet_data = nodes[0].get("lan_subnet", "")
-                    # Handle both old and new formats
-                    if isinstance(hub_lan_subnet_data, str):
-                        hub_lan_subnets_list = [hub_lan_subnet_data] if hub_lan_subnet_data else []
-                    else:
-                        hub_lan_subnets_list = hub_lan_subnet_data if isinstance(hub_lan_subnet_data, list) else []
-                    peer_config = {
-                        "node_id": hub_node_id,
-                        "public_key": node_keys[hub_node_id]["public_key"],
-                        "overlay_ip": node_ips[hub_node_id],
-                        "lan_subnet": hub_lan_subnets_list
-                    }
-                    peers.append(peer_config)
+                    peers = [peer_entry(hub_node)]
             
-            node_config = {
+            node_configs[node_id] = {
                 "node_id": node_id,
-                "node_name": node_name,
+                "node_name": node.name or node_id,
                 "private_key": node_keys[node_id]["private_key"],
                 "public_key": node_keys[node_id]["public_key"],
-                "overlay_ip": node_ips[node_id],
-                "lan_subnet": lan_subnets_list,  # Now always a list
+                "overlay_ip": node.overlay_ip,
+                "lan_subnet": node_lan_subnets[node_id],  # Now always a list
                 "peers": peers,
                 "mtu": mtu
             }
-            
-            mesh_config["nodes"][node_id] = node_config
-            node_configs[node_id] = node_config
         
         return node_configs
     
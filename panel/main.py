@@ -7,12 +7,13 @@ from contextlib import asynccontextmanager
 from pathlib import Path
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm.attributes import flag_modified
 from app.database import AsyncSessionLocal
 from app.models import Tunnel, Node, CoreResetConfig
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import RedirectResponse, FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from app.config import settings
@@ -20,7 +21,8 @@ from app.database import init_db
 from app.routers import nodes, tunnels, panel, status, logs, auth, core_health, mesh, overlay
 from app.node_server import NodeServer
 from app.frp_server import frp_server_manager
-from app.node_client import NodeClient
+from app.node_client import node_client
+from app.utils import default_frp_bind_port
 import logging
 
 logging.basicConfig(
@@ -69,6 +71,12 @@ async def lifespan(app: FastAPI):
     
     app.state.frp_server_manager = frp_server_manager
     
+    await _seed_reset_configs()
+    
+    await _backfill_node_columns()
+    
+    await _normalize_mesh_configs()
+    
     await _restore_node_tunnels()
     
     reset_task = asyncio.create_task(_auto_reset_scheduler(app))
@@ -86,8 +94,40 @@ async def lifespan(app: FastAPI):
     if hasattr(app.state, 'h2_server'):
         await app.state.h2_server.stop()
     
+    await node_client.close()
+    
+
+
+
+async def _seed_reset_configs():
+    """Create default core reset configs so the reset-config API stays read-only"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await core_health.seed_reset_configs(db)
+    except Exception as e:
+        logger.error(f"Error seeding core reset configs: {e}", exc_info=True)
 
 
+async def _backfill_node_columns():
+    """Populate the role/ip_address node columns for nodes registered before they existed"""
+    try:
+        async with AsyncSessionLocal() as db:
+            backfilled = await nodes.backfill_node_columns(db)
+            if backfilled:
+                logger.info(f"Backfilled role/ip_address for {backfilled} node(s)")
+    except Exception as e:
+        logger.error(f"Error backfilling node columns: {e}", exc_info=True)
+
+
+async def _normalize_mesh_configs():
+    """Rewrite legacy mesh configs and tunnels so mesh endpoints only handle one schema"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await mesh.normalize_legacy_mesh_configs(db)
+            await mesh.backfill_tunnel_mesh_ids(db)
+    except Exception as e:
+        logger.error(f"Error normalizing mesh configs: {e}", exc_info=True)
+
 
 async def _restore_frp_servers():
     """Restore FRP servers for active tunnels on startup"""
@@ -145,40 +185,37 @@ async def _restore_node_tunnels():
             
             logger.info(f"Found {len(reverse_tunnels)} active reverse tunnels to sync")
             
-            client = NodeClient()
+            client = node_client
             restored_count = 0
             failed_count = 0
             skipped_count = 0
             
+            # Load nodes once instead of re-querying them for every tunnel
+            result = await db.execute(select(Node))
+            all_nodes = result.scalars().all()
+            nodes_by_id = {n.id: n for n in all_nodes}
+            foreign_nodes = [n for n in all_nodes if n.role == "foreign"]
+            iran_nodes = [n for n in all_nodes if n.role == "iran"]
+            
             for tunnel in reverse_tunnels:
                 try:
                     iran_node = None
                     foreign_node = None
                     
                     if tunnel.node_id:
-                        result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-                        iran_node = result.scalar_one_or_none()
-                        if iran_node and iran_node.node_metadata.get("role") != "iran":
+                        iran_node = nodes_by_id.get(tunnel.node_id)
+                        if iran_node and iran_node.role != "iran":
                             foreign_node = iran_node
                             iran_node = None
                     
-                    if not foreign_node:
-                        result = await db.execute(select(Node))
-                        all_nodes = result.scalars().all()
-                        foreign_nodes = [n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "foreign"]
-                        if foreign_nodes:
-                            foreign_node = foreign_nodes[0]
+                    if not foreign_node and foreign_nodes:
+                        foreign_node = foreign_nodes[0]
                     
                     if not iran_node:
                         if tunnel.node_id:
-                            result = await db.execute(select(Node).where(Node.id == tunnel.node_id))
-                            iran_node = result.scalar_one_or_none()
-                        if not iran_node:
-                            result = await db.execute(select(Node))
-                            all_nodes = result.scalars().all()
-                            iran_nodes = [n for n in all_nodes if n.node_metadata and n.node_metadata.get("role") == "iran"]
-                            if iran_nodes:
-                                iran_node = iran_nodes[0]
+                            iran_node = nodes_by_id.get(tunnel.node_id)
+                        if not iran_node and iran_nodes:
+                            iran_node = iran_nodes[0]
                     
                     if not foreign_node or not iran_node:
                         logger.warning(f"Tunnel {tunnel.id}: Missing foreign or iran node, skipping sync (nodes will restore themselves)")
@@ -194,15 +231,13 @@ async def _restore_node_tunnels():
                     # Prepare configs based on tunnel type (same logic as create_tunnel)
                     if tunnel.core == "frp":
                         # Generate unique bind_port to avoid conflicts
-                        import hashlib
-                        port_hash = int(hashlib.md5(tunnel.id.encode()).hexdigest()[:8], 16)
-                        bind_port = server_spec.get("bind_port") or (7000 + (port_hash % 1000))
+                        bind_port = server_spec.get("bind_port") or default_frp_bind_port(tunnel.id)
                         token = server_spec.get("token")
                         server_spec["bind_port"] = bind_port
                         if token:
                             server_spec["token"] = token
                         
-                        iran_node_ip = iran_node.node_metadata.get("ip_address")
+                        iran_node_ip = iran_node.ip_address
                         if not iran_node_ip:
                             logger.warning(f"Tunnel {tunnel.id}: Iran node has no IP address, skipping")
                             continue
@@ -226,6 +261,7 @@ async def _restore_node_tunnels():
                     # Apply server config to iran node (Iran = SERVER)
                     if not iran_node.node_metadata.get("api_address"):
                         iran_node.node_metadata["api_address"] = f"http://{iran_node.node_metadata.get('ip_address', iran_node.fingerprint)}:{iran_node.node_metadata.get('api_port', 8888)}"
+                        flag_modified(iran_node, "node_metadata")
                         await db.commit()
                     
                     logger.info(f"Restoring tunnel {tunnel.id}: applying server config to iran node {iran_node.id}")
@@ -248,6 +284,7 @@ async def _restore_node_tunnels():
                     # Apply client config to foreign node (Foreign = CLIENT)
                     if not foreign_node.node_metadata.get("api_address"):
                         foreign_node.node_metadata["api_address"] = f"http://{foreign_node.node_metadata.get('ip_address', foreign_node.fingerprint)}:{foreign_node.node_metadata.get('api_port', 8888)}"
+                        flag_modified(foreign_node, "node_metadata")
                         await db.commit()
                     
                     logger.info(f"Restoring tunnel {tunnel.id}: applying client config to foreign node {foreign_node.id}")
@@ -284,7 +321,7 @@ async def _restore_node_tunnels():
 async def _auto_reset_scheduler(app: FastAPI):
     """Background task to auto-reset cores based on timer configuration"""
     from datetime import datetime, timedelta
-    from app.routers.core_health import _reset_core
+    from app.routers.core_health import _reset_core, invalidate_reset_config_cache
     
     while True:
         try:
@@ -307,6 +344,7 @@ async def _auto_reset_scheduler(app: FastAPI):
                             config.last_reset = now
                             config.next_reset = now + timedelta(minutes=config.interval_minutes)
                             await db.commit()
+                            invalidate_reset_config_cache(config.core)
                             await db.refresh(config)  # Ensure config is refreshed after commit
                             
                             await _reset_core(config.core, app, db)
@@ -327,6 +365,7 @@ app = FastAPI(
     description="Tunneling Control Panel",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs" if settings.docs_enabled else None,
     redoc_url="/redoc" if settings.docs_enabled else None,
 )
@@ -393,7 +432,7 @@ if __name__ == "__main__":
         
         if not cert_path.exists() or not key_path.exists():
             logger.warning(f"HTTPS enabled but certificate files not found. Using HTTP.")
-            uvicorn.run(app, host=settings.panel_host, port=settings.panel_port)
+            uvicorn.run(app, host=settings.panel_host, port=settings.panel_port, loop="uvloop", http="httptools")
         else:
             ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
             ssl_context.load_cert_chain(str(cert_path), str(key_path))
@@ -402,7 +441,9 @@ if __name__ == "__main__":
                 host=settings.panel_host,
                 port=settings.panel_port,
                 ssl_keyfile=str(key_path),
-                ssl_certfile=str(cert_path)
+                ssl_certfile=str(cert_path),
+                loop="uvloop",
+                http="httptools"
             )
     else:
-        uvicorn.run(app, host=settings.panel_host, port=settings.panel_port)
+        uvicorn.run(app, host=settings.panel_host, port=settings.panel_port, loop="uvloop", http="httptools")